@@ -1,10 +1,226 @@
+import json
 import sqlite3
 import os
-from datetime import datetime
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "environmental.db")
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "schema.sql")
 
+# --- STORAGE TUNING ---
+# The database runs in WAL mode: readers work off a snapshot and never block
+# the writer (or each other), and all writes go through one dedicated writer
+# thread so they are serialized instead of fighting over the write lock.
+JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # Safe with WAL, far fewer fsyncs than FULL
+# Page cache per connection. Every threadpool thread holds a reader
+# connection, so readers get a small cache (the OS page cache and mmap do
+# the heavy lifting) and only the single writer gets a large one.
+READER_CACHE_SIZE_KB = int(os.getenv("DB_READER_CACHE_SIZE_KB", "2048"))
+WRITER_CACHE_SIZE_KB = int(os.getenv("DB_WRITER_CACHE_SIZE_KB", os.getenv("DB_CACHE_SIZE_KB", "16384")))
+MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+CHECKPOINT_INTERVAL = float(os.getenv("DB_CHECKPOINT_INTERVAL", "60"))
+
+# --- CONNECTION MANAGEMENT ---
+# FastAPI runs sync handlers in a threadpool, so every worker thread keeps one
+# long-lived connection instead of paying connect()/close() on every query.
+# PRAGMAs are applied once, when the connection is opened.
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA synchronous = {SYNCHRONOUS}",
+    f"PRAGMA mmap_size = {MMAP_SIZE}",
+)
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_generation = 0
+
+def _open_connection(cache_size_kb=READER_CACHE_SIZE_KB):
+    """Open a new connection with the per-connection PRAGMAs applied"""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_kb)}")
+    return conn
+
+def get_connection():
+    """
+    Return this thread's long-lived connection, opening it on first use.
+
+    Connections opened before the last close_connections() call are
+    discarded and replaced transparently.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'generation', None) != _generation:
+        conn = _open_connection()
+        with _connections_lock:
+            _connections.append(conn)
+        _local.conn = conn
+        _local.generation = _generation
+    return conn
+
+class DatabaseWriter:
+    """
+    Owns the only connection that writes to the database.
+
+    Callers hand over a function taking the writer connection; it runs on the
+    writer thread and its return value (or exception) is passed back through
+    a Future. Write functions called from the writer thread itself run inline.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def submit(self, fn, *args):
+        """Queue fn(conn, *args) on the writer thread and return a Future"""
+        future = Future()
+        self.start()
+        self._queue.put((fn, args, future))
+        return future
+
+    def execute(self, fn, *args):
+        """Run fn(conn, *args) on the writer thread and wait for its result"""
+        if threading.current_thread() is self._thread:
+            return fn(self._conn, *args)
+        return self.submit(fn, *args).result()
+
+    def _run(self):
+        self._conn = _open_connection(WRITER_CACHE_SIZE_KB)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                fn, args, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(self._conn, *args))
+                except BaseException as e:
+                    self._conn.rollback()
+                    future.set_exception(e)
+        finally:
+            self._conn.close()
+
+_writer = DatabaseWriter()
+
+def open_connections():
+    """Start the writer and warm up the connection manager (called from the app lifespan)"""
+    _writer.start()
+    get_connection()
+    print("✅ Database connections ready")
+
+def close_connections():
+    """Stop the writer and close every connection handed out so far (called on shutdown)"""
+    global _generation
+    _writer.stop()
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"⚠️  Error closing connection: {e}")
+        closed = len(_connections)
+        _connections.clear()
+        _generation += 1
+    print(f"✅ Closed {closed} database connection(s)")
+
+def _checkpoint(conn, mode):
+    busy, log_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return {'busy': bool(busy), 'log_pages': log_pages, 'checkpointed': checkpointed}
+
+def checkpoint_wal(mode="PASSIVE"):
+    """
+    Copy committed WAL pages back into the main database file.
+
+    Args:
+        mode (str): PASSIVE (never blocks readers), FULL, RESTART or TRUNCATE
+
+    Returns:
+        dict: busy flag, WAL size in pages and number of pages checkpointed
+    """
+    return _writer.execute(_checkpoint, mode)
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+# Columns history gained after its first release
+HISTORY_ADDED_COLUMNS = {
+    "location": "TEXT",
+    "sensor_id": "TEXT",
+    "temp_c": "REAL",
+    "humidity": "REAL",
+}
+
+def _migrate(conn):
+    """
+    Upgrade an existing database in place
+    
+    - history gains the location, sensor_id, temp_c and humidity columns
+      (old rows keep NULL)
+    - history with ISO text timestamps is moved aside to history_iso; its rows
+      are copied into the new epoch-ms table once the schema has created it
+    - history_rollup without a location key or with ISO buckets is dropped; it
+      is derived data and gets rebuilt from history after the schema is applied
+    """
+    history_columns = _columns(conn, "history")
+    if history_columns:
+        for column, column_type in HISTORY_ADDED_COLUMNS.items():
+            if column not in history_columns:
+                conn.execute(f"ALTER TABLE history ADD COLUMN {column} {column_type}")
+                print(f"✅ Migrated history: added {column}")
+    
+    iso_history = history_columns and "ts" not in history_columns
+    if iso_history:
+        conn.execute("ALTER TABLE history RENAME TO history_iso")
+    
+    rollup_columns = _columns(conn, "history_rollup")
+    if rollup_columns and ("location" not in rollup_columns or iso_history):
+        conn.execute("DROP TABLE history_rollup")
+        print("✅ Migrated history_rollup: will rebuild")
+    conn.commit()
+
+def _copy_iso_history(conn):
+    """Move rows from a pre-epoch history_iso table into history"""
+    if not _columns(conn, "history_iso"):
+        return
+    # Old timestamps are naive local time, as written by datetime.now().isoformat()
+    copied = conn.execute("""
+        INSERT INTO history (id, ts, pm25, wind_kph, wind_dir, noise, risk_score, alert_triggered,
+                             location, sensor_id, temp_c, humidity)
+        SELECT id, CAST(round((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER),
+               pm25, wind_kph, wind_dir, noise, risk_score, alert_triggered,
+               location, sensor_id, temp_c, humidity
+        FROM history_iso WHERE julianday(timestamp) IS NOT NULL
+    """).rowcount
+    skipped = conn.execute("SELECT COUNT(*) FROM history_iso").fetchone()[0] - copied
+    conn.execute("DROP TABLE history_iso")
+    conn.commit()
+    print(f"✅ Migrated history to epoch-ms timestamps: {copied} rows" +
+          (f", skipped {skipped} with unreadable timestamps" if skipped else ""))
+
 def init_db():
     """Initialize the database with schema"""
     # Ensure the data folder exists
@@ -15,6 +231,20 @@ def init_db():
     # Connect to the SQLite file
     conn = sqlite3.connect(DB_PATH)
     
+    # Journal mode is persistent, so switching it once here covers every connection
+    journal_mode = conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}").fetchone()[0]
+    print(f"✅ Journal mode: {journal_mode}")
+    
+    # Incremental auto-vacuum lets retention give pages back without a full VACUUM.
+    # Existing files need one VACUUM for the setting to take effect.
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print("✅ Enabled incremental auto-vacuum")
+    
+    # Bring tables created by older versions up to date before the schema's indexes
+    _migrate(conn)
+    
     # Read and Execute the schema.sql file
     try:
         with open(SCHEMA_PATH, 'r') as f:
@@ -26,15 +256,31 @@ def init_db():
         conn.executescript("""
             CREATE TABLE IF NOT EXISTS history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
+                ts INTEGER NOT NULL,
                 pm25 REAL,
                 wind_kph REAL,
                 wind_dir TEXT,
                 noise REAL,
                 risk_score INTEGER,
-                alert_triggered BOOLEAN
+                alert_triggered BOOLEAN,
+                location TEXT,
+                sensor_id TEXT,
+                temp_c REAL,
+                humidity REAL
             );
             
+            CREATE TABLE IF NOT EXISTS history_rollup (
+                resolution TEXT NOT NULL,
+                location TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                pm25_min REAL, pm25_max REAL, pm25_sum REAL, pm25_count INTEGER,
+                wind_kph_min REAL, wind_kph_max REAL, wind_kph_sum REAL, wind_kph_count INTEGER,
+                noise_min REAL, noise_max REAL, noise_sum REAL, noise_count INTEGER,
+                risk_score_min REAL, risk_score_max REAL, risk_score_sum REAL, risk_score_count INTEGER,
+                PRIMARY KEY (resolution, location, bucket)
+            ) WITHOUT ROWID;
+            
             CREATE TABLE IF NOT EXISTS citizen_reports (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 timestamp TEXT NOT NULL,
@@ -63,44 +309,576 @@ def init_db():
                 citizen_comment TEXT,
                 location TEXT NOT NULL
             );
+            
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            INSERT OR IGNORE INTO data_versions (name, version) VALUES ('history', 0), ('citizen_reports', 0);
         """)
         print("✅ Created tables manually")
         
     conn.commit()
+    
+    _copy_iso_history(conn)
+    
+    # Backfill rollups for history written before they existed
+    has_history = conn.execute("SELECT 1 FROM history LIMIT 1").fetchone()
+    has_rollups = conn.execute("SELECT 1 FROM history_rollup LIMIT 1").fetchone()
+    if has_history and not has_rollups:
+        _update_rollups(conn, 0)
+        conn.commit()
+        print("✅ Rebuilt history rollups")
+    
     conn.close()
 
-def log_reading(data, risk_score):
-    """Save a new reading to the database"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# --- TIMESTAMPS ---
+# history stores time as integer epoch milliseconds (UTC): compact, ordered the
+# same way as time, and independent of the text format of whoever wrote it.
+# Naive datetimes and ISO strings are taken as local time, which is what
+# datetime.now() produces.
+
+def to_epoch_ms(value=None):
+    """
+    Convert a datetime, ISO string or epoch-ms number to epoch milliseconds
     
-    # Determine if alert should be triggered (score >= 50)
-    alert_triggered = risk_score >= 50
-    
-    c.execute(
-        "INSERT INTO history (timestamp, pm25, wind_kph, wind_dir, noise, risk_score, alert_triggered) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (
-            datetime.now().isoformat(), 
-            data.get('pm25'), 
-            data.get('wind_kph'),
-            data.get('wind_dir'),
-            data.get('noise'), 
-            risk_score,
-            alert_triggered
-        )
+    Args:
+        value: datetime, ISO 8601 string, int/float epoch ms, or None for now
+    
+    Returns:
+        int: Milliseconds since 1970-01-01 UTC
+    """
+    if value is None:
+        return int(time.time() * 1000)
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return round(value.timestamp() * 1000)
+
+def from_epoch_ms(ms):
+    """Epoch milliseconds as an ISO 8601 UTC string"""
+    return datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat(timespec="milliseconds")
+
+def _history_dict(row):
+    """History row as a dict, with the ISO timestamp API clients expect"""
+    reading = dict(row)
+    if 'ts' in reading:
+        reading['timestamp'] = from_epoch_ms(reading['ts'])
+    return reading
+
+# --- DATA VERSIONS ---
+# A counter per table, bumped inside the transaction of every change. Anything
+# derived from a table (e.g. a serialized API response) stays valid for as
+# long as the table's version is unchanged. The counters live in the
+# data_versions table, so writes made by any worker process are seen by all.
+
+def _bump_version(conn, table):
+    """Bump a table's version; call before the writing transaction commits"""
+    conn.execute("UPDATE data_versions SET version = version + 1 WHERE name = ?", (table,))
+
+def data_version(table):
+    """Current change counter of a table ('history' or 'citizen_reports')"""
+    row = get_connection().execute("SELECT version FROM data_versions WHERE name = ?", (table,)).fetchone()
+    return row[0] if row is not None else 0
+
+# --- WRITE-BEHIND BUFFER FOR HISTORY ---
+# Readings are collected in memory and written with one executemany + commit
+# per flush, instead of one INSERT + fsync per reading. A flush happens when
+# the buffer reaches HISTORY_FLUSH_SIZE rows or, via the lifespan flush loop,
+# once HISTORY_FLUSH_INTERVAL seconds have passed.
+HISTORY_FLUSH_SIZE = int(os.getenv("HISTORY_FLUSH_SIZE", "200"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "10"))
+# Failed flushes re-queue their rows; rows that failed this many times are
+# set aside in HISTORY_REJECTED_PATH (one JSON row per line) instead
+HISTORY_FLUSH_MAX_ATTEMPTS = int(os.getenv("HISTORY_FLUSH_MAX_ATTEMPTS", "5"))
+HISTORY_REJECTED_PATH = os.getenv(
+    "HISTORY_REJECTED_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "data", "rejected_readings.jsonl")
+)
+
+def _history_row(data, risk_score):
+    """Build a history row; alert is triggered when score >= 50"""
+    return (
+        to_epoch_ms(data.get('timestamp')),
+        data.get('pm25'),
+        data.get('wind_kph'),
+        data.get('wind_dir'),
+        data.get('noise'),
+        risk_score,
+        risk_score >= 50,
+        data.get('location'),
+        data.get('sensor_id'),
+        data.get('temp_c'),
+        data.get('humidity')
+    )
+
+def history_record(data, risk_score):
+    """
+    A reading shaped like a row of get_history, before it is written
+
+    Returns:
+        dict: HISTORY_COLUMNS plus the ISO 'timestamp'; id is None because it
+            is only assigned when the buffer is flushed
+    """
+    row = _history_row(data, risk_score)
+    reading = {'id': None, **dict(zip(HISTORY_COLUMNS[1:], row))}
+    reading['alert_triggered'] = int(reading['alert_triggered'])
+    return _history_dict(reading)
+
+def _insert_history_rows(conn, rows):
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM history").fetchone()[0]
+    conn.executemany(
+        """
+        INSERT INTO history (ts, pm25, wind_kph, wind_dir, noise, risk_score, alert_triggered,
+                             location, sensor_id, temp_c, humidity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows
     )
+    # Rollups are updated in the same transaction as the rows they summarize
+    _update_rollups(conn, last_id)
+    _bump_version(conn, 'history')
     conn.commit()
-    conn.close()
+    return len(rows)
 
-def get_history(limit=24):
-    """Fetch past readings for trend analysis"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute(f"SELECT * FROM history ORDER BY timestamp DESC LIMIT {limit}")
-    rows = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return rows
+class ReadingBuffer:
+    """In-memory write-behind queue of history rows"""
+
+    def __init__(self, max_size=HISTORY_FLUSH_SIZE, max_age=HISTORY_FLUSH_INTERVAL,
+                 max_attempts=HISTORY_FLUSH_MAX_ATTEMPTS, rejected_path=HISTORY_REJECTED_PATH):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+        self.rejected_path = rejected_path
+        self._rows = []
+        # Failed flush attempts so far, one entry per queued row
+        self._attempts = []
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, rows):
+        """Queue rows, flushing in the background once the size limit is hit"""
+        with self._lock:
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            self._attempts.extend([0] * len(rows))
+            full = len(self._rows) >= self.max_size
+        if full:
+            self.flush(wait=False)
+
+    def is_due(self):
+        """Whether the oldest queued row has waited longer than max_age"""
+        oldest = self._oldest
+        return oldest is not None and time.monotonic() - oldest >= self.max_age
+
+    def flush(self, wait=True):
+        """
+        Write every queued row in one transaction.
+        
+        Rows are put back into the queue if the write fails; after
+        max_attempts failed writes they are set aside (see _set_aside) so a
+        row the database keeps rejecting cannot block the queue forever.
+        
+        Returns:
+            int or Future: Rows written, or the pending write when wait=False
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+            attempts, self._attempts = self._attempts, []
+            self._oldest = None
+        if not rows:
+            return 0
+        
+        future = _writer.submit(_insert_history_rows, rows)
+        future.add_done_callback(lambda f: f.exception() and self._requeue(rows, attempts, f.exception()))
+        return future.result() if wait else future
+
+    def _requeue(self, rows, attempts, error):
+        attempts = [n + 1 for n in attempts]
+        retry = [(row, n) for row, n in zip(rows, attempts) if n < self.max_attempts]
+        rejected = [row for row, n in zip(rows, attempts) if n >= self.max_attempts]
+        if retry:
+            print(f"⚠️  History flush failed ({error}), re-queued {len(retry)} row(s)")
+            with self._lock:
+                self._rows[:0] = [row for row, _ in retry]
+                self._attempts[:0] = [n for _, n in retry]
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+        if rejected:
+            self._set_aside(rejected, error)
+
+    def _set_aside(self, rows, error):
+        """Append rows that failed max_attempts times to the rejected-rows file"""
+        try:
+            with open(self.rejected_path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+            print(f"❌ Set aside {len(rows)} reading(s) after {self.max_attempts} failed flushes "
+                  f"({error}), see {self.rejected_path}")
+        except OSError as e:
+            print(f"❌ Dropped {len(rows)} reading(s) after {self.max_attempts} failed flushes "
+                  f"({error}), could not write {self.rejected_path}: {e}")
+
+_reading_buffer = ReadingBuffer()
+
+def log_reading(data, risk_score):
+    """Queue a new reading for the database (written on the next flush)"""
+    _reading_buffer.add([_history_row(data, risk_score)])
+
+def log_readings(readings):
+    """
+    Queue a batch of readings for the database
+    
+    Args:
+        readings (list): (data, risk_score) tuples, as passed to log_reading
+    """
+    _reading_buffer.add([_history_row(data, risk_score) for data, risk_score in readings])
+
+def flush_readings(force=True):
+    """
+    Write queued readings to the history table
+    
+    Args:
+        force (bool): Flush even if the time limit has not been reached yet
+    
+    Returns:
+        int: Number of rows written
+    """
+    if not force and not _reading_buffer.is_due():
+        return 0
+    return _reading_buffer.flush()
+
+# --- TIME-BUCKETED ROLLUPS ---
+# history_rollup keeps min/max/sum/count per metric for every city and every
+# minute, hour and (UTC) day. A bucket is identified by the epoch-ms start of
+# the interval it covers.
+ROLLUP_METRICS = ('pm25', 'wind_kph', 'noise', 'risk_score')
+ROLLUP_RESOLUTIONS = {
+    # resolution: bucket size in seconds
+    '1m': 60,
+    '1h': 3600,
+    '1d': 86400,
+}
+# Upper bound on the points a trend query returns
+TREND_MAX_POINTS = int(os.getenv("TREND_MAX_POINTS", "500"))
+
+def _rollup_sql():
+    columns = ["count"]
+    selects = ["COUNT(*)"]
+    updates = ["count = count + excluded.count"]
+    for m in ROLLUP_METRICS:
+        columns += [f"{m}_min", f"{m}_max", f"{m}_sum", f"{m}_count"]
+        selects += [f"MIN({m})", f"MAX({m})", f"SUM({m})", f"COUNT({m})"]
+        updates += [
+            # Scalar min()/max() return NULL if either side is NULL
+            f"{m}_min = min(coalesce({m}_min, excluded.{m}_min), coalesce(excluded.{m}_min, {m}_min))",
+            f"{m}_max = max(coalesce({m}_max, excluded.{m}_max), coalesce(excluded.{m}_max, {m}_max))",
+            f"{m}_sum = coalesce({m}_sum, 0) + coalesce(excluded.{m}_sum, 0)",
+            f"{m}_count = {m}_count + excluded.{m}_count",
+        ]
+    return f"""
+        INSERT INTO history_rollup (resolution, location, bucket, {', '.join(columns)})
+        SELECT ?, coalesce(location, '') AS loc, ts - ts % ? AS bucket, {', '.join(selects)}
+        FROM history WHERE id > ?
+        GROUP BY loc, bucket
+        ON CONFLICT(resolution, location, bucket) DO UPDATE SET {', '.join(updates)}
+    """
+
+_ROLLUP_SQL = _rollup_sql()
+
+# Rollup rows merged across cities (used for the all-city trend)
+_ROLLUP_MERGED_COLUMNS = ", ".join(
+    ["SUM(count) AS count"] + [
+        f"MIN({m}_min) AS {m}_min, MAX({m}_max) AS {m}_max, SUM({m}_sum) AS {m}_sum, SUM({m}_count) AS {m}_count"
+        for m in ROLLUP_METRICS
+    ]
+)
+
+def _update_rollups(conn, after_id):
+    """Fold history rows with id > after_id into every rollup resolution"""
+    for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+        conn.execute(_ROLLUP_SQL, (resolution, seconds * 1000, after_id))
+
+def _rollup_row(row):
+    """Rollup row with averages, shaped like a history row"""
+    point = {'timestamp': from_epoch_ms(row['bucket']), 'ts': row['bucket'], 'count': row['count']}
+    for m in ROLLUP_METRICS:
+        n = row[f"{m}_count"]
+        point[m] = round(row[f"{m}_sum"] / n, 2) if n else None
+        point[f"{m}_min"] = row[f"{m}_min"]
+        point[f"{m}_max"] = row[f"{m}_max"]
+    return point
+
+# --- RANGE QUERIES ---
+# Windows include both ends: since <= ts <= until. The (ts, ...) and
+# (location, ts, ...) indexes carry the metric columns, so counts and
+# metric-only reads never touch the table itself.
+HISTORY_COLUMNS = (
+    'id', 'ts', 'pm25', 'wind_kph', 'wind_dir', 'noise',
+    'risk_score', 'alert_triggered', 'location', 'sensor_id', 'temp_c', 'humidity'
+)
+
+def _range_filter(since, until, location=None, sensor_id=None):
+    clauses = ["ts >= ?", "ts <= ?"]
+    params = [to_epoch_ms(since), to_epoch_ms(until)]
+    if location:
+        clauses.append("location = ?")
+        params.append(location)
+    if sensor_id:
+        clauses.append("sensor_id = ?")
+        params.append(sensor_id)
+    return " AND ".join(clauses), params
+
+def count_readings(since, until=None, location=None, sensor_id=None, limit=None):
+    """
+    Count readings in a time window
+    
+    Args:
+        since: Start of the window (datetime, ISO string or epoch ms)
+        until: End of the window (default: now)
+        location (str): Only readings for this city
+        sensor_id (str): Only readings from this sensor
+        limit (int): Stop counting after this many rows
+    
+    Returns:
+        int: Number of readings, at most limit
+    """
+    where, params = _range_filter(since, until, location, sensor_id)
+    if limit is None:
+        sql = f"SELECT COUNT(*) FROM history WHERE {where}"
+    else:
+        sql = f"SELECT COUNT(*) FROM (SELECT 1 FROM history WHERE {where} LIMIT ?)"
+        params.append(limit)
+    return get_connection().execute(sql, params).fetchone()[0]
+
+def get_readings_between(since, until=None, location=None, sensor_id=None,
+                         columns=None, limit=None, newest_first=False):
+    """
+    Fetch readings in a time window
+    
+    Args:
+        since: Start of the window (datetime, ISO string or epoch ms)
+        until: End of the window (default: now)
+        location (str): Only readings for this city
+        sensor_id (str): Only readings from this sensor
+        columns (list): Subset of HISTORY_COLUMNS (default: all)
+        limit (int): Maximum number of readings
+        newest_first (bool): Order by time descending instead of ascending
+    
+    Returns:
+        list: Reading dictionaries; 'timestamp' is added whenever 'ts' is selected
+    """
+    if columns is None:
+        select = "*"
+    else:
+        unknown = set(columns) - set(HISTORY_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown history columns: {sorted(unknown)}")
+        select = ", ".join(columns)
+    where, params = _range_filter(since, until, location, sensor_id)
+    sql = f"SELECT {select} FROM history WHERE {where} ORDER BY ts {'DESC' if newest_first else 'ASC'}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [_history_dict(row) for row in get_connection().execute(sql, params).fetchall()]
+
+def get_history_trend(since, until=None, max_points=TREND_MAX_POINTS, location=None):
+    """
+    Fetch readings for a time window at a resolution that fits max_points
+    
+    Raw rows are returned when the window holds at most max_points of them,
+    otherwise the finest rollup (1m, 1h, 1d) with at most max_points buckets.
+    
+    Args:
+        since (datetime): Start of the window
+        until (datetime): End of the window (default: now)
+        max_points (int): Maximum number of points to return
+        location (str): Only this city (default: all cities merged)
+    
+    Returns:
+        dict: resolution ('raw', '1m', '1h' or '1d') and data, oldest first
+    """
+    start, end = to_epoch_ms(since), to_epoch_ms(until)
+    
+    # Bounded count: never looks at more than max_points + 1 index entries
+    if count_readings(start, end, location, limit=max_points + 1) <= max_points:
+        return {'resolution': 'raw', 'data': get_readings_between(start, end, location)}
+    
+    window = (end - start) / 1000
+    for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+        if window / seconds <= max_points or resolution == '1d':
+            break
+    location_filter = "AND location = ?" if location else ""
+    location_params = (location,) if location else ()
+    rows = get_connection().execute(
+        f"""
+        SELECT bucket, {_ROLLUP_MERGED_COLUMNS} FROM history_rollup
+        WHERE resolution = ? AND bucket >= ? AND bucket <= ? {location_filter}
+        GROUP BY bucket
+        ORDER BY bucket DESC LIMIT ?
+        """,
+        (resolution, start - start % (seconds * 1000), end) + location_params + (max_points,)
+    ).fetchall()
+    return {'resolution': resolution, 'data': [_rollup_row(row) for row in reversed(rows)]}
+
+# --- RETENTION ---
+# Raw history is kept for HISTORY_RETENTION_DAYS; the rollups keep the
+# downsampled data for longer. 0 keeps data forever. Expired rows are deleted
+# in small transactions so queued writes get the writer in between.
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "7"))
+ROLLUP_RETENTION_DAYS = {
+    '1m': float(os.getenv("ROLLUP_1M_RETENTION_DAYS", "30")),
+    '1h': float(os.getenv("ROLLUP_1H_RETENTION_DAYS", "365")),
+    '1d': float(os.getenv("ROLLUP_1D_RETENTION_DAYS", "0")),
+}
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", "500"))
+
+def _delete_batch(conn, sql, params):
+    deleted = conn.execute(sql, params).rowcount
+    conn.commit()
+    return deleted
+
+def _commit_version(conn, table):
+    _bump_version(conn, table)
+    conn.commit()
+
+def _delete_in_batches(sql, params):
+    """Run a LIMITed DELETE until it removes less than a full batch"""
+    total = 0
+    while True:
+        deleted = _writer.execute(_delete_batch, sql, params + (RETENTION_BATCH_SIZE,))
+        total += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            return total
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+def _incremental_vacuum(conn, pages):
+    # executescript steps the PRAGMA to completion; a plain execute frees one page only
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def apply_retention(now=None):
+    """
+    Delete expired raw history and rollups, then release free pages
+    
+    Returns:
+        dict: Rows deleted per table/resolution and pages still on the freelist
+    """
+    now = to_epoch_ms(now)
+    result = {}
+    
+    if HISTORY_RETENTION_DAYS > 0:
+        cutoff = now - int(HISTORY_RETENTION_DAYS * 86400000)
+        result['history'] = _delete_in_batches(
+            "DELETE FROM history WHERE id IN (SELECT id FROM history WHERE ts < ? LIMIT ?)",
+            (cutoff,)
+        )
+        if result['history']:
+            _writer.execute(_commit_version, 'history')
+    
+    for resolution, days in ROLLUP_RETENTION_DAYS.items():
+        if days <= 0:
+            continue
+        # Keep the bucket the cutoff falls into
+        cutoff = now - int(days * 86400000)
+        cutoff -= cutoff % (ROLLUP_RESOLUTIONS[resolution] * 1000)
+        result[f'rollup_{resolution}'] = _delete_in_batches(
+            """
+            DELETE FROM history_rollup WHERE resolution = ? AND (location, bucket) IN (
+                SELECT location, bucket FROM history_rollup WHERE resolution = ? AND bucket < ? LIMIT ?
+            )
+            """,
+            (resolution, resolution, cutoff)
+        )
+    
+    result['freelist_pages'] = _writer.execute(_incremental_vacuum, VACUUM_PAGES)
+    return result
+
+def get_history(limit=24, location=None, sensor_id=None):
+    """
+    Fetch past readings for trend analysis
+    
+    Args:
+        limit (int): Maximum number of readings, newest first
+        location (str): Only readings for this city
+        sensor_id (str): Only readings from this sensor
+    
+    Returns:
+        list: List of reading dictionaries
+    """
+    return get_history_page(limit, location, sensor_id)[0]
+
+def get_history_page(limit=24, location=None, sensor_id=None, since=None, until=None,
+                     before=None, after=None):
+    """
+    Fetch one page of readings, newest first, using keyset pagination
+    
+    Pages are keyed on (ts, id) instead of OFFSET, so every page is a short
+    range scan on the ts index no matter how deep it is.
+    
+    Args:
+        limit (int): Maximum number of readings
+        location (str): Only readings for this city
+        sensor_id (str): Only readings from this sensor
+        since: Only readings at or after this time (datetime, ISO string or epoch ms)
+        until: Only readings at or before this time
+        before (tuple): (ts, id) cursor; only readings older than it (next page back)
+        after (tuple): (ts, id) cursor; only readings newer than it (delta since last seen)
+    
+    Returns:
+        tuple: (readings, has_more). With after, has_more means more new readings
+            than limit are waiting; otherwise older readings exist beyond the page.
+    """
+    clauses = []
+    params = []
+    
+    if location:
+        clauses.append("location = ?")
+        params.append(location)
+    
+    if sensor_id:
+        clauses.append("sensor_id = ?")
+        params.append(sensor_id)
+    
+    if since is not None:
+        clauses.append("ts >= ?")
+        params.append(to_epoch_ms(since))
+    
+    if until is not None:
+        clauses.append("ts <= ?")
+        params.append(to_epoch_ms(until))
+    
+    # The plain ts bound lets the index do the range; the OR only breaks ties
+    if before is not None:
+        clauses.append("ts <= ? AND (ts < ? OR id < ?)")
+        params += [before[0], before[0], before[1]]
+    
+    if after is not None:
+        clauses.append("ts >= ? AND (ts > ? OR id > ?)")
+        params += [after[0], after[0], after[1]]
+    
+    # A delta reads forward from the cursor so no new reading is skipped
+    order = "ASC" if after is not None else "DESC"
+    query = "SELECT * FROM history"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += f" ORDER BY ts {order}, id {order} LIMIT ?"
+    params.append(limit + 1)
+    
+    rows = get_connection().execute(query, params).fetchall()
+    has_more = len(rows) > limit
+    readings = [_history_dict(row) for row in rows[:limit]]
+    if after is not None:
+        readings.reverse()
+    return readings, has_more
 
 # ===== CITIZEN PARTICIPATION FUNCTIONS =====
 
@@ -118,32 +896,34 @@ def submit_citizen_report(report_data):
     Returns:
         int: ID of the created report
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    def _write(conn):
+        c = conn.cursor()
     
-    c.execute("""
-        INSERT INTO citizen_reports 
-        (timestamp, location, latitude, longitude, report_type, severity, 
-         description, photo_path, citizen_name, citizen_contact, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')
-    """, (
-        datetime.now().isoformat(),
-        report_data.get('location'),
-        report_data.get('latitude'),
-        report_data.get('longitude'),
-        report_data.get('report_type'),
-        report_data.get('severity'),
-        report_data.get('description'),
-        report_data.get('photo_path'),
-        report_data.get('citizen_name'),
-        report_data.get('citizen_contact')
-    ))
-    
-    report_id = c.lastrowid
-    conn.commit()
-    conn.close()
+        c.execute("""
+            INSERT INTO citizen_reports 
+            (timestamp, location, latitude, longitude, report_type, severity, 
+             description, photo_path, citizen_name, citizen_contact, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending')
+        """, (
+            datetime.now().isoformat(),
+            report_data.get('location'),
+            report_data.get('latitude'),
+            report_data.get('longitude'),
+            report_data.get('report_type'),
+            report_data.get('severity'),
+            report_data.get('description'),
+            report_data.get('photo_path'),
+            report_data.get('citizen_name'),
+            report_data.get('citizen_contact')
+        ))
+    
+        report_id = c.lastrowid
+        _bump_version(conn, 'citizen_reports')
+        conn.commit()
     
-    return report_id
+        return report_id
+    
+    return _writer.execute(_write)
 
 def get_citizen_reports(location=None, status=None, limit=50):
     """
@@ -157,8 +937,7 @@ def get_citizen_reports(location=None, status=None, limit=50):
     Returns:
         list: List of report dictionaries
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
     c = conn.cursor()
     
     query = "SELECT * FROM citizen_reports WHERE 1=1"
@@ -177,7 +956,6 @@ def get_citizen_reports(location=None, status=None, limit=50):
     
     c.execute(query, params)
     rows = [dict(row) for row in c.fetchall()]
-    conn.close()
     
     return rows
 
@@ -193,23 +971,25 @@ def validate_citizen_report(report_id, validated_by_sensor=False, validation_not
     Returns:
         bool: Success status
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    def _write(conn):
+        c = conn.cursor()
     
-    c.execute("""
-        UPDATE citizen_reports 
-        SET status = 'validated',
-            validated_by_sensor = ?,
-            validation_timestamp = ?,
-            validation_notes = ?
-        WHERE id = ?
-    """, (validated_by_sensor, datetime.now().isoformat(), validation_notes, report_id))
+        c.execute("""
+            UPDATE citizen_reports 
+            SET status = 'validated',
+                validated_by_sensor = ?,
+                validation_timestamp = ?,
+                validation_notes = ?
+            WHERE id = ?
+        """, (validated_by_sensor, datetime.now().isoformat(), validation_notes, report_id))
     
-    success = c.rowcount > 0
-    conn.commit()
-    conn.close()
+        success = c.rowcount > 0
+        _bump_version(conn, 'citizen_reports')
+        conn.commit()
+    
+        return success
     
-    return success
+    return _writer.execute(_write)
 
 def update_report_votes(report_id, upvote=True):
     """
@@ -222,20 +1002,21 @@ def update_report_votes(report_id, upvote=True):
     Returns:
         dict: Updated vote counts
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    def _write(conn):
+        c = conn.cursor()
     
-    field = "upvotes" if upvote else "downvotes"
-    c.execute(f"UPDATE citizen_reports SET {field} = {field} + 1 WHERE id = ?", (report_id,))
+        field = "upvotes" if upvote else "downvotes"
+        c.execute(f"UPDATE citizen_reports SET {field} = {field} + 1 WHERE id = ?", (report_id,))
     
-    c.execute("SELECT upvotes, downvotes FROM citizen_reports WHERE id = ?", (report_id,))
-    result = dict(c.fetchone())
+        c.execute("SELECT upvotes, downvotes FROM citizen_reports WHERE id = ?", (report_id,))
+        result = dict(c.fetchone())
     
-    conn.commit()
-    conn.close()
+        _bump_version(conn, 'citizen_reports')
+        conn.commit()
     
-    return result
+        return result
+    
+    return _writer.execute(_write)
 
 def submit_alert_validation(alert_id, validation_type, location, citizen_comment=None):
     """
@@ -250,20 +1031,21 @@ def submit_alert_validation(alert_id, validation_type, location, citizen_comment
     Returns:
         int: ID of the validation record
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    def _write(conn):
+        c = conn.cursor()
     
-    c.execute("""
-        INSERT INTO alert_validations 
-        (alert_id, timestamp, validation_type, citizen_comment, location)
-        VALUES (?, ?, ?, ?, ?)
-    """, (alert_id, datetime.now().isoformat(), validation_type, citizen_comment, location))
+        c.execute("""
+            INSERT INTO alert_validations 
+            (alert_id, timestamp, validation_type, citizen_comment, location)
+            VALUES (?, ?, ?, ?, ?)
+        """, (alert_id, datetime.now().isoformat(), validation_type, citizen_comment, location))
     
-    validation_id = c.lastrowid
-    conn.commit()
-    conn.close()
+        validation_id = c.lastrowid
+        conn.commit()
+    
+        return validation_id
     
-    return validation_id
+    return _writer.execute(_write)
 
 def get_alert_validations(alert_id=None):
     """
@@ -275,8 +1057,7 @@ def get_alert_validations(alert_id=None):
     Returns:
         list: List of validation records
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
     c = conn.cursor()
     
     if alert_id:
@@ -285,7 +1066,6 @@ def get_alert_validations(alert_id=None):
         c.execute("SELECT * FROM alert_validations ORDER BY timestamp DESC LIMIT 100")
     
     rows = [dict(row) for row in c.fetchall()]
-    conn.close()
     
     return rows
 
@@ -299,18 +1079,18 @@ def get_report_statistics(location=None):
     Returns:
         dict: Statistics including counts by type and status
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
     c = conn.cursor()
     
-    location_filter = f"WHERE location = '{location}'" if location else ""
+    location_filter = "WHERE location = ?" if location else ""
+    params = (location,) if location else ()
     
     # Count by type
     c.execute(f"""
         SELECT report_type, COUNT(*) as count 
         FROM citizen_reports {location_filter}
         GROUP BY report_type
-    """)
+    """, params)
     by_type = {row['report_type']: row['count'] for row in c.fetchall()}
     
     # Count by status
@@ -318,22 +1098,25 @@ def get_report_statistics(location=None):
         SELECT status, COUNT(*) as count 
         FROM citizen_reports {location_filter}
         GROUP BY status
-    """)
+    """, params)
     by_status = {row['status']: row['count'] for row in c.fetchall()}
     
     # Get total and recent (last 24h)
-    c.execute(f"SELECT COUNT(*) as total FROM citizen_reports {location_filter}")
+    c.execute(f"SELECT COUNT(*) as total FROM citizen_reports {location_filter}", params)
     total = c.fetchone()['total']
     
+    # Report timestamps are local ISO strings (datetime.now().isoformat()), so the
+    # cutoff has to be one too: SQLite's datetime('now') is UTC with a space
+    # separator and does not compare correctly against them
+    since = (datetime.now() - timedelta(days=1)).isoformat()
     c.execute(f"""
         SELECT COUNT(*) as recent 
         FROM citizen_reports 
         {location_filter}
-        {'AND' if location else 'WHERE'} timestamp >= datetime('now', '-1 day')
-    """)
+        {'AND' if location else 'WHERE'} timestamp >= ?
+    """, params + (since,))
     recent = c.fetchone()['recent']
     
-    conn.close()
     
     return {
         'total': total,
@@ -1,41 +1,173 @@
-import json
+import asyncio
 import os
 import base64
-from datetime import datetime
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+from datetime import datetime, timedelta
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import Optional
 
 # Import your custom services
-from services.api_client import fetch_environmental_data
-from risk_engine import calculate_risk
+from services.api_client import (
+    fetch_environmental_data_async, enrich_sensor_network_async, weather_client, weather_cache,
+    weather_upstream_status, sensor_network_version, simulator_state
+)
+from services.shared_state import LeaderLease
+from services.sensor_registry import sensor_registry
+from services.scheduler import (
+    SamplingScheduler, load_monitored_cities, is_known_city, SAMPLE_INTERVAL, SCHEDULER_LEASE_TTL
+)
+from services.broadcast import Broadcaster, format_sse
+from services.response_cache import ResponseCache
+from services.serialization import FastJSONResponse
+from services.compression import CompressionMiddleware
+from services.interpolation import (
+    GridEngine, GRID_METRICS, GRID_CACHE_SIZE, TILE_SIZE, render_tile, encode_grid
+)
+from services.correlations import (
+    CorrelationEngine, DEFAULT_WINDOW, MATRIX_COLUMNS, LAGGED_MAX_POINTS, LAGGED_MAX_LAG,
+    correlation_matrix, time_grid, lagged_cross_correlation
+)
 from database import (
-    init_db, log_reading, get_history,
+    init_db, open_connections, close_connections, checkpoint_wal, CHECKPOINT_INTERVAL,
+    flush_readings, HISTORY_FLUSH_INTERVAL, apply_retention, RETENTION_INTERVAL,
+    get_history, get_history_page, get_history_trend, TREND_MAX_POINTS,
+    get_readings_between, to_epoch_ms, data_version, history_record,
     submit_citizen_report, get_citizen_reports, validate_citizen_report,
     update_report_votes, submit_alert_validation, get_alert_validations,
     get_report_statistics
 )
 
+# --- Background Tasks ---
+
+# Samples every monitored city in the background; /api/monitor only reads its snapshots.
+# With several workers only the lease holder samples, writes history and runs
+# retention; the others serve the rounds it publishes through the shared store.
+scheduler = SamplingScheduler(
+    load_monitored_cities(), SAMPLE_INTERVAL, store=simulator_state,
+    lease=LeaderLease(simulator_state, "scheduler", SCHEDULER_LEASE_TTL)
+)
+
+# Pushes every sampling round to the /api/stream subscribers
+broadcaster = Broadcaster()
+
+# Rolling correlations per known city, seeded from history and updated every round
+correlation_engine = CorrelationEngine(lambda city, limit: get_history(limit, location=city), is_known=is_known_city)
+
+async def update_correlations(snapshots):
+    """Fold a sampling round into the rolling correlations"""
+    for snapshot in snapshots:
+        correlation_engine.add(snapshot["data"])
+
+scheduler.listeners.append(update_correlations)
+
+# Serialized read responses, reused until the data behind them changes
+response_cache = ResponseCache()
+# Interpolated PM2.5/noise grid, rebuilt once per sensor tick
+grid_engine = GridEngine()
+# Tiles and grid crops, kept apart so they cannot evict the JSON responses
+grid_cache = ResponseCache(GRID_CACHE_SIZE)
+GRID_MAX_ZOOM = 18
+
+async def publish_round(snapshots):
+    """Fan out one sampling round: per-city monitor data, readings and correlations, shared sensors"""
+    if not broadcaster.subscriber_count:
+        return
+    for snapshot in snapshots:
+        city = snapshot["data"].get("location")
+        broadcaster.publish("monitor", build_monitor_payload(snapshot, city), city=city)
+        broadcaster.publish("reading", build_history_row(snapshot), city=city)
+    
+    # Correlations only for the cities someone is watching (None: all cities)
+    for city in broadcaster.subscribed_cities():
+        result = await asyncio.to_thread(correlation_engine.get, city)
+        if result is not None and result["sample_size"] >= 2:
+            broadcaster.publish("correlations", result, city=city, exact=True)
+    
+    sensors, _, version = sensor_registry.snapshot()
+    if sensors is not None:
+        broadcaster.publish("sensors", {"sensors": await enrich_sensor_network_async(sensors, version)})
+
+scheduler.listeners.append(publish_round)
+
+async def wal_checkpoint_loop(interval):
+    """Periodically checkpoint the WAL so it does not grow without bound"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(checkpoint_wal)
+        except Exception as e:
+            print(f"⚠️  WAL checkpoint failed: {e}")
+
+async def history_flush_loop(interval):
+    """Flush buffered history rows once they have waited long enough (only the leader buffers any)"""
+    while True:
+        await asyncio.sleep(min(interval, 1.0))
+        try:
+            await asyncio.to_thread(flush_readings, False)
+        except Exception as e:
+            print(f"⚠️  History flush failed: {e}")
+
+async def retention_loop(interval):
+    """Prune expired history and rollups in the background (on the sampling leader only)"""
+    while True:
+        try:
+            if not scheduler.is_leader:
+                await asyncio.sleep(min(interval, SCHEDULER_LEASE_TTL))
+                continue
+            deleted = await asyncio.to_thread(apply_retention)
+            if any(v for k, v in deleted.items() if k != 'freelist_pages'):
+                print(f"🧹 Retention: {deleted}")
+        except Exception as e:
+            print(f"⚠️  Retention run failed: {e}")
+        await asyncio.sleep(interval)
+
+async def stop_background_tasks(tasks):
+    """Cancel background tasks and wait for them to finish"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 # Lifespan: Handles startup and shutdown tasks
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # This runs when the server starts
     print("🚀 Starting Environmental Monitoring System...")
     init_db()
+    open_connections()
+    sensor_registry.load()
+    correlation_engine.warm([None, *scheduler.cities])
+    # First round runs before serving so every city has a snapshot (on followers,
+    # whatever the leader published last)
+    await scheduler.tick()
+    background_tasks = [
+        asyncio.create_task(scheduler.run()),
+        asyncio.create_task(history_flush_loop(HISTORY_FLUSH_INTERVAL)),
+        asyncio.create_task(wal_checkpoint_loop(CHECKPOINT_INTERVAL)),
+        asyncio.create_task(retention_loop(RETENTION_INTERVAL)),
+    ]
     print("✅ Database initialized and system ready!")
     yield
     # This runs when the server stops
     print("🛑 Shutting down system...")
+    await stop_background_tasks(background_tasks)
+    await asyncio.to_thread(scheduler.lease.release)
+    # Drain the write-behind buffer so no readings are lost
+    flushed = flush_readings()
+    print(f"✅ Flushed {flushed} buffered reading(s)")
+    checkpoint_wal("TRUNCATE")
+    close_connections()
+    await weather_client.close()
 
 app = FastAPI(
     title="Environmental Monitoring API",
     description="Real-time environmental monitoring with risk analysis",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS: Allow Frontend to communicate with Backend
@@ -47,6 +179,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON/text responses above COMPRESSION_MIN_SIZE (brotli if installed, else gzip)
+app.add_middleware(CompressionMiddleware)
+
 # --- API ENDPOINTS ---
 
 @app.get("/")
@@ -59,85 +194,170 @@ def root():
     }
 
 @app.get("/api/monitor")
-def monitor(city: str = "Kozhikode"):
+async def monitor(city: str = "Kozhikode"):
     """
-    Fetches live environmental data, calculates risk, and logs to database.
+    Returns the latest sampled environmental data and risk assessment.
+    Readings are produced and logged by the background sampling scheduler.
     
     Query Parameters:
     - city: Location to monitor (default: Kozhikode)
     """
     try:
-        # Fetch environmental data
-        data = fetch_environmental_data(city)
+        # Serve the latest snapshot; known cities that are not sampled yet join the rotation
+        snapshot = scheduler.latest(city) or await scheduler.add_city(city)
+        if snapshot is None:
+            raise HTTPException(status_code=404, detail=f"Unknown city: {city}")
+        return build_monitor_payload(snapshot, city)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error in monitor endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/stream")
+async def stream(request: Request, city: Optional[str] = None):
+    """
+    Server-Sent Events stream of live data, pushed after every sampling round.
+    Replaces polling /api/monitor, /api/history, /api/correlations and /api/sensors.
+    
+    Events: monitor (same payload as /api/monitor), reading (new history row),
+    correlations and sensors.
+    
+    Query Parameters:
+    - city: Only stream monitor/reading events for this city (default: all cities)
+    """
+    initial = []
+    if city:
+        snapshot = scheduler.latest(city) or await scheduler.add_city(city)
+        if snapshot is None:
+            raise HTTPException(status_code=404, detail=f"Unknown city: {city}")
+        initial.append(format_sse("monitor", build_monitor_payload(snapshot, city)))
+    
+    subscription = broadcaster.subscribe(city)
+    return StreamingResponse(
+        broadcaster.stream(subscription, initial, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/history")
+def history(request: Request, limit: int = 24, city: str = None, sensor_id: str = None,
+            since: str = None, until: str = None, cursor: str = None, after: str = None):
+    """
+    Returns historical readings for trend analysis, newest first.
+    
+    Query Parameters:
+    - limit: Number of records to return (default: 24)
+    - city: Only readings for this city (default: all cities)
+    - sensor_id: Only readings from this sensor
+    - since / until: Time window (ISO 8601 or epoch milliseconds)
+    - cursor: next_cursor of a previous page; returns the page before it
+    - after: latest_cursor of a previous response; returns only newer readings
+    
+    A client that keeps passing latest_cursor back as after only ever
+    downloads readings it has not seen yet. Responses carry an ETag and
+    stay cached until new readings are written.
+    """
+    if limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    if cursor and after:
+        raise HTTPException(status_code=400, detail="cursor and after cannot be combined")
+    before = decode_cursor(cursor) if cursor else None
+    newer_than = decode_cursor(after) if after else None
+    since_time, until_time = parse_time(since), parse_time(until)
+    
+    def build():
+        records, has_more = get_history_page(
+            limit, location=city, sensor_id=sensor_id,
+            since=since_time, until=until_time,
+            before=before, after=newer_than
+        )
         
-        # Calculate risk score and alerts
-        score, alerts = calculate_risk(data)
+        if records:
+            latest_cursor = encode_cursor(records[0])
+        else:
+            latest_cursor = after
         
-        # Save to database for historical trends
-        log_reading(data, score)
+        # Paging back only makes sense away from a delta
+        next_cursor = None
+        if not after and has_more:
+            next_cursor = encode_cursor(records[-1])
         
         return {
             "status": "success",
-            "timestamp": data.get("timestamp"),
-            "location": data.get("location", city),
-            "current": {
-                "temperature": data.get("temp_c"),
-                "humidity": data.get("humidity"),
-                "pm25": data.get("pm25"),
-                "aqi": data.get("aqi"),
-                "wind_speed": data.get("wind_kph"),
-                "wind_direction": data.get("wind_dir"),
-                "noise": data.get("noise")
-            },
-            "risk_assessment": {
-                "score": score,
-                "level": get_risk_level(score),
-                "alerts": alerts
-            }
+            "count": len(records),
+            "data": records,
+            "has_more": has_more,
+            "next_cursor": next_cursor,
+            "latest_cursor": latest_cursor
         }
+    
+    try:
+        key = ("history", limit, city, sensor_id, since, until, cursor, after)
+        return response_cache.respond(request, key, data_version("history"), build)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error in monitor endpoint: {e}")
+        print(f"❌ Error fetching history: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/history")
-def history(limit: int = 24):
+@app.get("/api/history/trend")
+def history_trend(hours: float = 24, max_points: int = TREND_MAX_POINTS, city: str = None):
     """
-    Returns historical readings for trend analysis.
+    Returns readings for a long time window at a resolution that keeps the
+    response under max_points (raw rows, or 1-minute/1-hour/1-day rollups
+    with min/max/avg per metric).
     
     Query Parameters:
-    - limit: Number of records to return (default: 24)
+    - hours: Length of the window ending now (default: 24)
+    - max_points: Maximum number of points to return
+    - city: Only this city (default: all cities merged)
     """
     try:
-        records = get_history(limit)
+        if hours <= 0 or max_points <= 0:
+            raise HTTPException(status_code=400, detail="hours and max_points must be positive")
+        trend = get_history_trend(
+            datetime.now() - timedelta(hours=hours), max_points=max_points, location=city
+        )
         return {
             "status": "success",
-            "count": len(records),
-            "data": records
+            "resolution": trend["resolution"],
+            "count": len(trend["data"]),
+            "data": trend["data"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Error fetching history: {e}")
+        print(f"❌ Error fetching trend: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/sensors")
-def get_sensors():
+async def get_sensors(request: Request, bbox: Optional[str] = None):
     """
     Returns sensor locations for map visualization with real-time enriched data.
-    Reads from data/mock_sensors.json and enriches with live PM2.5 and Noise values.
+    Stations come from the in-memory sensor registry (data/mock_sensors.json,
+    reloaded when the file changes) and are enriched with live PM2.5 and Noise
+    values. The serialized response is reused until the enrichment is recomputed.
+    
+    Query Parameters:
+    - bbox: Only stations in the viewport "west,south,east,north"
+      (Leaflet's map.getBounds().toBBoxString()); default: all stations
     """
-    file_path = os.path.join(os.path.dirname(__file__), "..", "data", "mock_sensors.json")
-    try:
-        with open(file_path, "r") as f:
-            sensors = json.load(f)
-            # Import the enrich function from api_client
-            from services.api_client import enrich_sensor_network
-            # Enrich sensors with real-time data
-            enriched_sensors = enrich_sensor_network(sensors)
-            return {
-                "status": "success",
-                "count": len(enriched_sensors),
-                "sensors": enriched_sensors
-            }
-    except FileNotFoundError:
+    bounds = parse_bbox(bbox)
+    sensors, index, version = sensor_registry.snapshot()
+    if sensors is not None:
+        # Enrich sensors with real-time data (all cities fetched concurrently)
+        enriched_sensors = await enrich_sensor_network_async(sensors, version)
+        if bounds is not None:
+            # The enriched list is in registry order, so index positions apply
+            enriched_sensors = [enriched_sensors[p] for p in index.bbox(*bounds)]
+        network_version = await asyncio.to_thread(sensor_network_version)
+        return response_cache.respond(request, ("sensors", bounds), network_version, lambda: {
+            "status": "success",
+            "count": len(enriched_sensors),
+            "sensors": enriched_sensors
+        })
+    else:
         # Return default sensor if file not found
         default_sensor = [{
             "id": "sensor_default",
@@ -154,34 +374,288 @@ def get_sensors():
             "sensors": default_sensor
         }
 
+@app.get("/api/sensors/nearest")
+async def get_nearest_sensors(lat: float, lng: float, k: int = 3, max_km: Optional[float] = None):
+    """
+    Returns the stations closest to a location, with live readings.
+    
+    Query Parameters:
+    - lat / lng: Location
+    - k: Number of stations (default: 3)
+    - max_km: Only stations within this distance
+    """
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180 or k < 1:
+        raise HTTPException(status_code=400, detail="Invalid location or k")
+    if sensor_registry.stations() is None:
+        return {"status": "warning", "message": "mock_sensors.json not found", "count": 0, "sensors": []}
+    nearest = await nearest_sensor_readings(lat, lng, k, max_km)
+    return {
+        "status": "success",
+        "count": len(nearest),
+        "sensors": nearest
+    }
+
+@app.get("/api/grid/{metric}/{z}/{x}/{y}.png")
+async def get_grid_tile(request: Request, metric: str, z: int, x: int, y: int):
+    """
+    Returns a PNG heatmap tile of the interpolated grid for a Leaflet TileLayer.
+    
+    Path Parameters:
+    - metric: pm25 or noise
+    - z / x / y: Web Mercator tile coordinates
+    """
+    if metric not in GRID_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {list(GRID_METRICS)}")
+    if not 0 <= z <= GRID_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+    grid, tick = await current_grid()
+    # Rendering is a few ms of NumPy work; keep it off the event loop
+    return await asyncio.to_thread(
+        grid_cache.respond, request, ("grid-tile", metric, z, x, y), tick,
+        lambda: render_tile(grid, metric, z, x, y), "image/png"
+    )
+
+@app.get("/api/grid/{metric}")
+async def get_grid(request: Request, metric: str, bbox: Optional[str] = None, z: Optional[int] = None):
+    """
+    Returns the interpolated grid as compact binary for client-side drawing.
+    
+    The body is a 28-byte header (little endian: b"EMSG", uint16 rows,
+    uint16 cols, float64 south, west, step) followed by rows x cols float32
+    values, southern row first, NaN where no station is in range.
+    
+    Query Parameters:
+    - bbox: Only cells in "west,south,east,north" (default: whole grid)
+    - z: Map zoom; cells are thinned to about one per screen pixel (default: all cells)
+    """
+    if metric not in GRID_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {list(GRID_METRICS)}")
+    bounds = parse_bbox(bbox)
+    grid, tick = await current_grid()
+    bounds = bounds or grid.bounds
+    stride = 1 if z is None else max(1, int(360 / (TILE_SIZE * 2 ** max(z, 0)) / grid.step))
+    return grid_cache.respond(
+        request, ("grid", metric, bounds, stride), tick,
+        lambda: encode_grid(*grid.crop(metric, *bounds, stride)), "application/octet-stream"
+    )
+
+@app.get("/api/upstream")
+def upstream_status():
+    """
+    Reports the health of the weather upstream and its cache.
+    """
+    return {
+        "status": "success",
+        "weather": weather_upstream_status(),
+        "weather_cache": weather_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "grid_cache": grid_cache.stats()
+    }
+
 @app.get("/api/correlations")
-def get_correlations():
+def get_correlations(request: Request, city: str = None, window: int = DEFAULT_WINDOW):
     """
     Analyzes correlations between environmental factors.
+    
+    Coefficients are kept up to date by the correlation engine as readings
+    arrive, so this only reads them; the serialized response is reused until
+    the engine changes.
+    
+    Query Parameters:
+    - city: Only readings for this city (default: all cities)
+    - window: Number of most recent readings to correlate (CORRELATION_WINDOWS)
     """
-    try:
-        records = get_history(24)
+    if city and not correlation_engine.is_known(city):
+        raise HTTPException(status_code=404, detail=f"Unknown city: {city}")
+    
+    def build():
+        result = correlation_engine.get(city, window)
         
-        if len(records) < 2:
+        if result["sample_size"] < 2:
             return {
                 "status": "insufficient_data",
                 "message": "Need at least 2 data points for correlation analysis"
             }
         
-        # Calculate correlations (simplified Pearson correlation)
-        correlations = calculate_correlations(records)
-        
         return {
             "status": "success",
-            "correlations": correlations,
-            "sample_size": len(records)
+            "correlations": result["correlations"],
+            "sample_size": result["sample_size"],
+            "window": window
         }
+    
+    try:
+        if window not in correlation_engine.windows:
+            raise ValueError(f"window must be one of {list(correlation_engine.windows)}")
+        key = ("correlations", city, window)
+        return response_cache.respond(request, key, correlation_engine.version, build)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"❌ Error calculating correlations: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/correlations/matrix")
+def get_correlation_matrix(city: str = None, limit: int = 500):
+    """
+    Full correlation matrix of every numeric metric over recent readings.
+    
+    Each coefficient uses only the readings where both metrics are present.
+    
+    Query Parameters:
+    - city: Only readings for this city (default: all cities)
+    - limit: Number of most recent readings (default: 500, at most LAGGED_MAX_POINTS)
+    """
+    if limit < 2:
+        raise HTTPException(status_code=400, detail="limit must be at least 2")
+    if limit > LAGGED_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"limit must be at most {LAGGED_MAX_POINTS}")
+    try:
+        records = get_history(limit, location=city)
+        return {
+            "status": "success",
+            "sample_size": len(records),
+            **correlation_matrix(records)
+        }
+    except Exception as e:
+        print(f"❌ Error calculating correlation matrix: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/correlations/lagged")
+def get_lagged_correlation(city: str, other_city: str = None, metric: str = "pm25",
+                           other_metric: str = None, hours: float = 24,
+                           step_seconds: int = 300, max_lag: int = 12):
+    """
+    Lagged cross-correlation between two series, for source-direction analysis.
+    
+    Both series are resampled onto the same time grid first. A best_lag > 0
+    means changes in city/metric show up in other_city/other_metric that many
+    steps later.
+    
+    Query Parameters:
+    - city, metric: First series (metric default: pm25)
+    - other_city, other_metric: Second series (default: same city / metric)
+    - hours: Length of the window ending now (default: 24)
+    - step_seconds: Grid spacing (default: 300)
+    - max_lag: Largest shift to try, in steps (default: 12, at most LAGGED_MAX_LAG)
+    
+    The grid (hours * 3600 / step_seconds points) may hold at most
+    LAGGED_MAX_POINTS points.
+    """
+    other_city = other_city or city
+    other_metric = other_metric or metric
+    for name in (metric, other_metric):
+        if name not in MATRIX_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"metric must be one of {list(MATRIX_COLUMNS)}")
+    if hours <= 0 or step_seconds <= 0 or max_lag < 0:
+        raise HTTPException(status_code=400, detail="hours and step_seconds must be positive, max_lag not negative")
+    if hours * 3600 / step_seconds > LAGGED_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"hours * 3600 / step_seconds must be at most {LAGGED_MAX_POINTS}")
+    if max_lag > LAGGED_MAX_LAG:
+        raise HTTPException(status_code=400, detail=f"max_lag must be at most {LAGGED_MAX_LAG}")
+    try:
+        end = to_epoch_ms()
+        start = end - int(hours * 3600000)
+        step = step_seconds * 1000
+        x = time_grid(get_readings_between(start, end, city, columns=["ts", metric]), metric, start, end, step)
+        y = time_grid(get_readings_between(start, end, other_city, columns=["ts", other_metric]), other_metric, start, end, step)
+        return {
+            "status": "success",
+            "x": {"city": city, "metric": metric},
+            "y": {"city": other_city, "metric": other_metric},
+            "step_seconds": step_seconds,
+            **lagged_cross_correlation(x, y, max_lag)
+        }
+    except Exception as e:
+        print(f"❌ Error calculating lagged correlation: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # --- Helper Functions ---
 
+def build_monitor_payload(snapshot, city):
+    """Shape a scheduler snapshot as the /api/monitor response"""
+    data, score, alerts = snapshot["data"], snapshot["score"], snapshot["alerts"]
+    return {
+        "status": "success",
+        "timestamp": data.get("timestamp"),
+        "location": data.get("location", city),
+        "current": {
+            "temperature": data.get("temp_c"),
+            "humidity": data.get("humidity"),
+            "pm25": data.get("pm25"),
+            "aqi": data.get("aqi"),
+            "wind_speed": data.get("wind_kph"),
+            "wind_direction": data.get("wind_dir"),
+            "noise": data.get("noise")
+        },
+        "risk_assessment": {
+            "score": score,
+            "level": get_risk_level(score),
+            "alerts": alerts
+        }
+    }
+
+def build_history_row(snapshot):
+    """Shape a scheduler snapshot like a row returned by /api/history"""
+    return history_record(snapshot["data"], snapshot["score"])
+
+def encode_cursor(reading):
+    """Opaque pagination cursor for a history row"""
+    return f"{reading['ts']}-{reading['id']}"
+
+def decode_cursor(cursor):
+    try:
+        ts, row_id = cursor.split("-")
+        return int(ts), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+def parse_time(value):
+    """Query parameter time: epoch milliseconds or ISO 8601"""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid time: {value}")
+
+def parse_bbox(value):
+    """Query parameter bbox "west,south,east,north" as (south, west, north, east)"""
+    if value is None:
+        return None
+    try:
+        west, south, east, north = (float(v) for v in value.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {value}")
+    if south > north or west > east:
+        raise HTTPException(status_code=400, detail=f"Invalid bbox: {value}")
+    return (south, west, north, east)
+
+async def nearest_sensor_readings(lat, lng, k, max_km=None):
+    """Live readings of the k stations closest to a location, each with distance_km"""
+    sensors, index, version = sensor_registry.snapshot()
+    if sensors is None:
+        return []
+    nearest = index.nearest(lat, lng, k, max_km)
+    if not nearest:
+        return []
+    enriched_sensors = await enrich_sensor_network_async(sensors, version)
+    return [{**enriched_sensors[p], "distance_km": round(km, 2)} for p, km in nearest]
+
+async def current_grid():
+    """Interpolated grid of the current sensor tick, with the tick it belongs to"""
+    sensors, index, version = sensor_registry.snapshot()
+    if sensors is None:
+        raise HTTPException(status_code=404, detail="No sensors to interpolate")
+    readings = await enrich_sensor_network_async(sensors, version)
+    tick = (version, await asyncio.to_thread(sensor_network_version))
+    grid = await asyncio.to_thread(grid_engine.get, tick, readings, index)
+    if grid is None:
+        raise HTTPException(status_code=404, detail="No sensors with coordinates")
+    return grid, tick
+
 def get_risk_level(score):
     """Convert risk score to readable level"""
     if score >= 70:
@@ -193,45 +667,6 @@ def get_risk_level(score):
     else:
         return "Low"
 
-def calculate_correlations(records):
-    """Calculate correlations between environmental metrics"""
-    if len(records) < 2:
-        return {}
-    
-    # Extract data series
-    pm25_values = [r['pm25'] for r in records if r['pm25'] is not None]
-    wind_values = [r['wind_kph'] for r in records if r['wind_kph'] is not None]
-    noise_values = [r['noise'] for r in records if r['noise'] is not None]
-    
-    def pearson_correlation(x, y):
-        """Calculate Pearson correlation coefficient"""
-        if len(x) != len(y) or len(x) < 2:
-            return 0.0
-        
-        n = len(x)
-        sum_x = sum(x)
-        sum_y = sum(y)
-        sum_xy = sum(xi * yi for xi, yi in zip(x, y))
-        sum_x2 = sum(xi * xi for xi in x)
-        sum_y2 = sum(yi * yi for yi in y)
-        
-        numerator = n * sum_xy - sum_x * sum_y
-        denominator = ((n * sum_x2 - sum_x ** 2) * (n * sum_y2 - sum_y ** 2)) ** 0.5
-        
-        if denominator == 0:
-            return 0.0
-        
-        return numerator / denominator
-    
-    # Calculate all correlations
-    min_len = min(len(pm25_values), len(wind_values), len(noise_values))
-    
-    return {
-        "pm25_wind": round(pearson_correlation(pm25_values[:min_len], wind_values[:min_len]), 3),
-        "pm25_noise": round(pearson_correlation(pm25_values[:min_len], noise_values[:min_len]), 3),
-        "wind_noise": round(pearson_correlation(wind_values[:min_len], noise_values[:min_len]), 3)
-    }
-
 # ===== CITIZEN PARTICIPATION ENDPOINTS =====
 
 # Pydantic models for request validation
@@ -298,7 +733,7 @@ async def create_citizen_report(report: CitizenReportModel):
         report_id = submit_citizen_report(report_data)
         
         # Auto-validate if sensor data correlates
-        auto_validation = check_report_against_sensors(report)
+        auto_validation = await check_report_against_sensors(report)
         
         return {
             "status": "success",
@@ -322,11 +757,11 @@ def get_reports(location: Optional[str] = None, status: Optional[str] = None, li
     """
     try:
         reports = get_citizen_reports(location=location, status=status, limit=limit)
-        return {
+        return FastJSONResponse({
             "status": "success",
             "count": len(reports),
             "reports": reports
-        }
+        })
     except Exception as e:
         print(f"❌ Error fetching reports: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -377,7 +812,7 @@ def validate_alert(validation: AlertValidationModel):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/citizen/statistics")
-def get_citizen_statistics(location: Optional[str] = None):
+def get_citizen_statistics(request: Request, location: Optional[str] = None):
     """
     Get statistics about citizen participation.
     
@@ -385,25 +820,57 @@ def get_citizen_statistics(location: Optional[str] = None):
     - location: Optional location filter
     """
     try:
-        stats = get_report_statistics(location=location)
-        return {
+        # The 24h count also moves with the clock, so the version rolls every minute
+        version = (data_version("citizen_reports"), int(datetime.now().timestamp() // 60))
+        return response_cache.respond(request, ("citizen_statistics", location), version, lambda: {
             "status": "success",
             "location": location or "All regions",
-            "statistics": stats
-        }
+            "statistics": get_report_statistics(location=location)
+        })
     except Exception as e:
         print(f"❌ Error fetching statistics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Helper function for auto-validation
-def check_report_against_sensors(report: CitizenReportModel):
+# Stations within this distance of a report's coordinates are used to check it
+REPORT_SENSOR_RADIUS_KM = float(os.getenv("REPORT_SENSOR_RADIUS_KM", "10"))
+REPORT_SENSOR_COUNT = int(os.getenv("REPORT_SENSOR_COUNT", "3"))
+
+async def check_report_against_sensors(report: CitizenReportModel):
     """
     Check if a citizen report correlates with current sensor data.
     Returns validation status and correlation score.
+    
+    Reports with coordinates are checked against the closest stations (within
+    REPORT_SENSOR_RADIUS_KM); otherwise against the reported city's readings.
+    Locations that are not a known city are left for manual review, so free
+    text in a report never creates simulator state for a new location.
     """
     try:
-        # Fetch current sensor data for the reported location
-        sensor_data = fetch_environmental_data(report.location)
+        nearby = []
+        if report.latitude is not None and report.longitude is not None:
+            nearby = await nearest_sensor_readings(
+                report.latitude, report.longitude, REPORT_SENSOR_COUNT, REPORT_SENSOR_RADIUS_KM
+            )
+        if nearby:
+            # The highest reading near the report decides; name where it was measured
+            pm25_sensor = max(nearby, key=lambda s: s.get('pm25', 0))
+            noise_sensor = max(nearby, key=lambda s: s.get('noise', 0))
+            sensor_data = {'pm25': pm25_sensor.get('pm25', 0), 'noise': noise_sensor.get('noise', 0)}
+            sources = {
+                'pm25': f" at {pm25_sensor.get('name')} ({pm25_sensor['distance_km']} km away)",
+                'noise': f" at {noise_sensor.get('name')} ({noise_sensor['distance_km']} km away)"
+            }
+        elif is_known_city(report.location):
+            # Fetch current sensor data for the reported location
+            sensor_data = await fetch_environmental_data_async(report.location)
+            sources = {'pm25': "", 'noise': ""}
+        else:
+            return {
+                "validated": False,
+                "confidence": "pending",
+                "notes": "No sensors near the reported location; awaiting manual review"
+            }
         
         correlation_found = False
         validation_notes = []
@@ -413,14 +880,14 @@ def check_report_against_sensors(report: CitizenReportModel):
             pm25 = sensor_data.get('pm25', 0)
             if pm25 > 35:  # Moderate or higher
                 correlation_found = True
-                validation_notes.append(f"Sensors confirm elevated PM2.5: {pm25:.1f} µg/m³")
+                validation_notes.append(f"Sensors confirm elevated PM2.5: {pm25:.1f} µg/m³{sources['pm25']}")
         
         # Check noise reports against noise sensors
         if report.report_type == 'noise':
             noise = sensor_data.get('noise', 0)
             if noise > 70:  # Above normal
                 correlation_found = True
-                validation_notes.append(f"Sensors confirm elevated noise: {noise} dB")
+                validation_notes.append(f"Sensors confirm elevated noise: {noise} dB{sources['noise']}")
         
         # Auto-validate if correlation found
         if correlation_found and report.severity >= 3:
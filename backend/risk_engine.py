@@ -1,113 +1,405 @@
+import json
+import operator
+import os
+import string
+import threading
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+# --- RULE TABLE ---
+# Thresholds, points and alert messages live in data/risk_rules.json. The
+# table is compiled once into per-rule threshold arrays (looked up with
+# bisect / np.searchsorted) and recompiled whenever the file changes.
+RULES_PATH = os.getenv(
+    "RISK_RULES_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "data", "risk_rules.json")
+)
+# Seconds between two checks of the rule file's mtime
+RULES_CHECK_INTERVAL = float(os.getenv("RISK_RULES_CHECK_INTERVAL", "2"))
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+}
+
+class RuleError(ValueError):
+    """The risk rule table is missing or invalid"""
+
+class CompiledRule:
+    """
+    One rule of the table, ready for evaluation.
+
+    A 'tiers' rule is an if/elif chain on one metric. It only changes outcome
+    at its thresholds, so the outcome is precomputed for every band: band 2i
+    lies strictly below cuts[i] (and above cuts[i-1]), band 2i+1 is exactly
+    cuts[i], and the last band lies above every cut. A rule without a metric
+    has a single outcome, applied when all its 'when' conditions hold.
+    """
+
+    def __init__(self, spec, alert_index):
+        self.name = spec.get('name', '')
+        self.metric = spec.get('metric')
+        when = spec.get('when', [])
+        for condition in when + spec.get('tiers', []):
+            if condition.get('op') not in OPERATORS:
+                raise RuleError(f"Unknown operator {condition.get('op')!r} in rule {self.name!r}")
+            if isinstance(condition['value'], bool) or not isinstance(condition['value'], (int, float)):
+                raise RuleError(f"Threshold {condition['value']!r} in rule {self.name!r} is not a number")
+        self.when_spec = [(c['metric'], c['op'], c['value']) for c in when]
+        self.when = [(metric, OPERATORS[op], value) for metric, op, value in self.when_spec]
+
+        if self.metric is None:
+            self.cuts = []
+            outcomes = [self._outcome(spec, alert_index)]
+        else:
+            tiers = spec.get('tiers')
+            if not isinstance(tiers, list) or not tiers:
+                raise RuleError(f"Rule {self.name!r} on {self.metric!r} needs a non-empty list of tiers")
+            self._check_order(tiers)
+            self.cuts = sorted({tier['value'] for tier in tiers})
+            outcomes = [self._first_match(tiers, probe, alert_index) for probe in self._probes()]
+        self.outcomes = outcomes
+
+        # Array form of the same table for the batch evaluator
+        self.cuts_array = np.array(self.cuts, dtype=np.float64)
+        self.points_array = np.array([o[0] if o else 0 for o in outcomes], dtype=np.int64)
+        self.codes_array = np.array([(1 << o[1]) if o and o[1] is not None else 0 for o in outcomes], dtype=np.uint64)
+
+    def _check_order(self, tiers):
+        """
+        Tiers are checked top to bottom, so '>'/'>=' thresholds must
+        decrease and '<'/'<=' thresholds increase; otherwise a later tier
+        could never match.
+        """
+        last = {}
+        for tier in tiers:
+            op, value = tier['op'], tier['value']
+            direction = 'above' if op in ('>', '>=') else 'below' if op in ('<', '<=') else None
+            previous = last.get(direction)
+            if previous is not None and (value >= previous if direction == 'above' else value <= previous):
+                raise RuleError(f"Tiers of rule {self.name!r} are not sorted: {op} {value!r} can never match")
+            if direction is not None:
+                last[direction] = value
+
+    def _probes(self):
+        """One value inside each band"""
+        cuts = self.cuts
+        probes = []
+        for i, cut in enumerate(cuts):
+            probes.append(cut - 1 if i == 0 else (cuts[i - 1] + cut) / 2)
+            probes.append(cut)
+        probes.append(cuts[-1] + 1)
+        return probes
+
+    @staticmethod
+    def _outcome(tier, alert_index):
+        alert = tier.get('alert')
+        return (tier.get('points', 0), alert_index.get(alert), tier.get('message'))
+
+    def _first_match(self, tiers, value, alert_index):
+        for tier in tiers:
+            if OPERATORS[tier['op']](value, tier['value']):
+                return self._outcome(tier, alert_index)
+        return None
+
+class RiskRules:
+    """A compiled rule table with scalar and vectorized evaluators"""
+
+    def __init__(self, table):
+        try:
+            self.max_score = table.get('max_score', 100)
+            self.defaults = dict(table['defaults'])
+            specs = table['rules']
+
+            # Alert codes, one bit per alert, in emission order
+            self.alert_codes = []
+            self.alert_messages = {}
+            for spec in specs:
+                for tier in spec.get('tiers', [spec]):
+                    alert = tier.get('alert')
+                    if alert and alert not in self.alert_messages:
+                        self.alert_codes.append(alert)
+                        self.alert_messages[alert] = tier.get('message', alert)
+            if len(self.alert_codes) > 64:
+                raise RuleError("At most 64 distinct alerts are supported")
+            alert_index = {name: i for i, name in enumerate(self.alert_codes)}
+
+            self.rules = [CompiledRule(spec, alert_index) for spec in specs]
+        except RuleError:
+            raise
+        except (KeyError, TypeError, ValueError, IndexError, AttributeError) as e:
+            raise RuleError(f"Invalid risk rule table: {e!r}") from e
+
+        known = set(self.defaults) | {'score'}
+        for rule in self.rules:
+            for metric in [rule.metric] + [m for m, _, _ in rule.when]:
+                if metric is not None and metric not in known:
+                    raise RuleError(f"Rule {rule.name!r} uses metric {metric!r} without a default")
+
+        self.numeric_columns = {
+            name: default for name, default in self.defaults.items()
+            if isinstance(default, (int, float)) and not isinstance(default, bool)
+        }
+        self.code_dtype = np.uint32 if len(self.alert_codes) <= 32 else np.uint64
+
+        self._has_heat_index = 'temp_c' in self.defaults and 'humidity' in self.defaults
+        self._check_messages(specs)
+        self._evaluate = self._compile_evaluator()
+
+    def _check_messages(self, specs):
+        """
+        Format every message once against sample values, so a bad field or
+        format spec is rejected at load time instead of failing requests
+        """
+        samples = self._values(self.defaults)
+        as_floats = {
+            name: float(value) if name in self.numeric_columns or name == 'heat_index' else value
+            for name, value in samples.items()
+        }
+        for values in (samples, as_floats):
+            for spec in specs:
+                for tier in spec.get('tiers') or [spec]:
+                    message = tier.get('message')
+                    if not message:
+                        continue
+                    try:
+                        message.format_map({**values, 'score': 0})
+                    except (KeyError, ValueError, TypeError, IndexError, AttributeError) as e:
+                        raise RuleError(f"Invalid message {message!r} in rule {spec.get('name', '')!r}: {e!r}") from e
+
+    def _values(self, data):
+        values = {name: data.get(name, default) for name, default in self.defaults.items()}
+        if self._has_heat_index:
+            # Approximate heat index, available to alert messages
+            values['heat_index'] = values['temp_c'] + (0.5 * (values['humidity'] - 50))
+        return values
+
+    @staticmethod
+    def _fstring(template, names):
+        """Turn a message template into f-string source over the evaluator's locals"""
+        parts = []
+        try:
+            fields = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise RuleError(f"Invalid message template {template!r}: {e}") from e
+        for literal, field, spec, conversion in fields:
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+            if field not in names:
+                raise RuleError(f"Unknown field {{{field}}} in message {template!r}")
+            if spec and any(c in spec for c in '{}\\'):
+                raise RuleError(f"Unsupported format spec in message {template!r}")
+            parts.append('{' + names[field] + (f'!{conversion}' if conversion else '') + (f':{spec}' if spec else '') + '}')
+        return 'f' + repr(''.join(parts))
+
+    def _compile_evaluator(self):
+        """
+        Generate the scalar evaluator for this table.
+
+        The generated function reads each metric once, looks its band up in
+        the precomputed threshold arrays with bisect and formats messages as
+        f-strings, so scoring a reading costs no more than a hand-written
+        if/elif chain.
+        """
+        names = {name: f"v{i}" for i, name in enumerate(self.defaults)}
+        names['score'] = 'score'
+        if self._has_heat_index:
+            names['heat_index'] = 'heat_index'
+        env = {'bisect_left': bisect_left}
+
+        lines = ["def evaluate(data):"]
+        for name, default in self.defaults.items():
+            lines.append(f"    {names[name]} = data.get({name!r}, {default!r})")
+        if self._has_heat_index:
+            lines.append(f"    heat_index = {names['temp_c']} + (0.5 * ({names['humidity']} - 50))")
+        lines += ["    score = 0", "    alerts = []"]
+
+        for k, rule in enumerate(self.rules):
+            indent = "    "
+            if rule.when_spec:
+                conditions = " and ".join(f"{names[m]} {op} {value!r}" for m, op, value in rule.when_spec)
+                lines.append(f"    if {conditions}:")
+                indent = "        "
+
+            if rule.metric is None:
+                points, _, message = rule.outcomes[0]
+                lines.append(f"{indent}score += {points!r}")
+                if message:
+                    lines.append(f"{indent}alerts.append({self._fstring(message, names)})")
+                continue
+
+            messages = list(dict.fromkeys(o[2] for o in rule.outcomes if o and o[2]))
+            env[f"C{k}"] = tuple(rule.cuts)
+            env[f"P{k}"] = tuple(o[0] if o else 0 for o in rule.outcomes)
+            env[f"M{k}"] = tuple(messages.index(o[2]) if o and o[2] else -1 for o in rule.outcomes)
+            x = names[rule.metric]
+            lines += [
+                f"{indent}i = bisect_left(C{k}, {x})",
+                f"{indent}b = 2 * i + 1 if i < {len(rule.cuts)} and C{k}[i] == {x} else 2 * i",
+                f"{indent}score += P{k}[b]",
+                f"{indent}m = M{k}[b]",
+            ]
+            for j, message in enumerate(messages):
+                keyword = "if" if j == 0 else "elif"
+                lines.append(f"{indent}{keyword} m == {j}:")
+                lines.append(f"{indent}    alerts.append({self._fstring(message, names)})")
+
+        lines.append(f"    return min(score, {self.max_score!r}), alerts")
+        self.source = "\n".join(lines)
+        try:
+            code = compile(self.source, "<risk_rules>", "exec")
+        except (SyntaxError, ValueError) as e:
+            raise RuleError(f"Risk rules do not compile: {e}") from e
+        exec(code, env)
+        return env['evaluate']
+
+    def evaluate(self, data):
+        """Score one reading; returns (score capped at max_score, alert messages)"""
+        return self._evaluate(data)
+
+    def evaluate_batch(self, columns):
+        """Score equal-length metric arrays; returns (scores, alert code bitmasks)"""
+        n = len(next(iter(columns.values()))) if columns else 0
+        cols = {
+            name: np.asarray(columns[name], dtype=np.float64) if name in columns else np.full(n, default, dtype=np.float64)
+            for name, default in self.numeric_columns.items()
+        }
+        score = np.zeros(n, dtype=np.int64)
+        codes = np.zeros(n, dtype=np.uint64)
+
+        for rule in self.rules:
+            mask = None
+            for metric, op, value in rule.when:
+                condition = op(score if metric == 'score' else cols[metric], value)
+                mask = condition if mask is None else mask & condition
+
+            if rule.metric is None:
+                band = np.zeros(n, dtype=np.intp)
+            else:
+                x = score if rule.metric == 'score' else cols[rule.metric]
+                i = np.searchsorted(rule.cuts_array, x, side='left')
+                exact = rule.cuts_array[np.minimum(i, len(rule.cuts) - 1)] == x
+                band = 2 * i + ((i < len(rule.cuts)) & exact)
+
+            points = rule.points_array[band]
+            rule_codes = rule.codes_array[band]
+            if mask is not None:
+                points = np.where(mask, points, 0)
+                rule_codes = np.where(mask, rule_codes, 0).astype(np.uint64)
+            score += points
+            codes |= rule_codes
+
+        return np.minimum(score, self.max_score), codes.astype(self.code_dtype)
+
+    def describe(self, code, data):
+        """Expand an alert code bitmask into messages, in evaluation order"""
+        values = self._values(data)
+        code = int(code)
+        return [
+            self.alert_messages[name].format_map(values)
+            for i, name in enumerate(self.alert_codes)
+            if code & (1 << i)
+        ]
+
+def load_rules(path=RULES_PATH):
+    """Read and compile a rule table file"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return RiskRules(json.load(f))
+    except FileNotFoundError as e:
+        raise RuleError(f"Risk rules not found at {path}") from e
+    except json.JSONDecodeError as e:
+        raise RuleError(f"Risk rules at {path} are not valid JSON: {e}") from e
+
+_rules = None
+_rules_mtime = None
+_rules_checked = 0.0
+_rules_lock = threading.Lock()
+
+def reload_rules(force=False):
+    """
+    Recompile the rule table if the file changed (or always, with force).
+
+    An invalid table is reported and the previous rules stay active.
+
+    Returns:
+        RiskRules: The rules now in use
+    """
+    global _rules, _rules_mtime, _rules_checked
+    with _rules_lock:
+        _rules_checked = time.monotonic()
+        try:
+            mtime = os.path.getmtime(RULES_PATH)
+        except OSError:
+            mtime = None
+        if force or _rules is None or mtime != _rules_mtime:
+            try:
+                _rules = load_rules(RULES_PATH)
+                if _rules_mtime is not None:
+                    print(f"✅ Risk rules reloaded ({len(_rules.rules)} rules)")
+                _rules_mtime = mtime
+            except RuleError as e:
+                if _rules is None:
+                    raise
+                print(f"⚠️  Keeping previous risk rules: {e}")
+                _rules_mtime = mtime
+        return _rules
+
+def get_rules():
+    """Compiled rules in use, checking the file for changes every RULES_CHECK_INTERVAL seconds"""
+    if _rules is None or time.monotonic() - _rules_checked >= RULES_CHECK_INTERVAL:
+        return reload_rules()
+    return _rules
+
 def calculate_risk(data):
     """
     Implements correlation detection and risk scoring with environmental factors.
     Enhanced version with contextual alert generation for Kerala's industrial zones.
+
+    Rules (air quality, heat, humidity, AQI, noise, the correlation combos and
+    the final recommendations) come from data/risk_rules.json.
+    """
+    return get_rules().evaluate(data)
+
+
+# ===== BATCH (VECTORIZED) SCORING =====
+
+def readings_to_columns(readings):
+    """Turn a list of reading dicts into the columnar input of calculate_risk_batch"""
+    columns = {}
+    for name, default in get_rules().numeric_columns.items():
+        columns[name] = np.array([r.get(name, default) for r in readings], dtype=np.float64)
+    return columns
+
+def calculate_risk_batch(columns):
+    """
+    Score many readings at once; identical to calling calculate_risk on each.
+
+    Args:
+        columns (dict): Equal-length arrays keyed by pm25, temp_c, humidity,
+            aqi, wind_kph and noise. Missing columns take the rule defaults.
+
+    Returns:
+        tuple: (scores, codes) - int array capped at max_score, and an array of
+            alert bit flags (expand with describe_alert_codes)
+    """
+    return get_rules().evaluate_batch(columns)
+
+def describe_alert_codes(code, data):
+    """
+    Expand one alert code into the messages calculate_risk would return.
+
+    Args:
+        code (int): Entry of the codes array from calculate_risk_batch
+        data (dict): The reading it was computed from (for values in the messages)
+
+    Returns:
+        list: Alert strings, in calculate_risk order
     """
-    score = 0
-    alerts = []
-    
-    # Extract values
-    pm25 = data.get('pm25', 0)
-    temp = data.get('temp_c', 25)
-    humidity = data.get('humidity', 60)
-    aqi = data.get('aqi', 1)
-    wind_kph = data.get('wind_kph', 0)
-    wind_dir = data.get('wind_dir', 'N')
-    noise = data.get('noise', 0)
-    
-    # Air Quality Check (PM2.5) - Critical for industrial zones
-    if pm25 > 55:
-        score += 40
-        alerts.append(f"🚨 CRITICAL: PM2.5 at {pm25:.1f} µg/m³ (Hazardous - Avoid outdoor activity)")
-    elif pm25 > 35:
-        score += 30
-        alerts.append(f"⚠️ UNHEALTHY: PM2.5 at {pm25:.1f} µg/m³ (Sensitive groups should limit exposure)")
-    elif pm25 > 25:
-        score += 15
-        alerts.append(f"⚠️ Moderate: PM2.5 at {pm25:.1f} µg/m³ (Consider reducing prolonged outdoor activity)")
-
-    # Temperature Risk - Kerala climate considerations
-    if temp > 38:
-        score += 30
-        alerts.append(f"🌡️ EXTREME HEAT: {temp}°C - Heat stroke risk HIGH")
-    elif temp > 35:
-        score += 20
-        alerts.append(f"🌡️ Very Hot: {temp}°C - Stay hydrated, avoid midday sun")
-    elif temp > 32:
-        score += 10
-        alerts.append(f"🌡️ Hot conditions: {temp}°C - Monitor vulnerable populations")
-
-    # Humidity Risk - High humidity amplifies heat stress
-    if humidity > 85:
-        score += 20
-        alerts.append(f"💧 Very high humidity: {humidity}% - Heat index significantly elevated")
-    elif humidity > 75:
-        score += 10
-
-    # AQI Risk - US EPA Index
-    if aqi >= 5:
-        score += 40
-        alerts.append("☢️ AIR QUALITY HAZARDOUS: Everyone should avoid outdoor activity")
-    elif aqi >= 4:
-        score += 30
-        alerts.append("🔴 AIR QUALITY UNHEALTHY: Health alert for all groups")
-    elif aqi >= 3:
-        score += 20
-        alerts.append("🟠 AIR QUALITY UNHEALTHY for sensitive groups")
-
-    # CORRELATION LOGIC 1: High PM2.5 + Wind Direction
-    # Helps identify pollution source direction
-    if pm25 > 25:
-        if wind_kph > 20:
-            score += 25
-            alerts.append(f"🌬️ POLLUTION SPREAD RISK: High winds ({wind_kph:.1f} km/h) from {wind_dir} may be dispersing pollutants from industrial areas")
-        elif wind_kph > 10:
-            score += 15
-            alerts.append(f"🌬️ Pollution transport: Moderate winds ({wind_kph:.1f} km/h) from {wind_dir} direction")
-        elif wind_kph < 5:
-            score += 10
-            alerts.append(f"⚠️ Stagnant air: Low wind speed ({wind_kph:.1f} km/h) - Pollutants accumulating")
-
-    # CORRELATION LOGIC 2: High Temp + High Humidity (Heat Index)
-    if temp > 32 and humidity > 75:
-        score += 25
-        # Calculate approximate heat index
-        heat_index = temp + (0.5 * (humidity - 50))
-        alerts.append(f"🥵 HEAT INDEX WARNING: Feels like {heat_index:.0f}°C - Dangerous heat stress conditions")
-
-    # CORRELATION LOGIC 3: High PM2.5 + Low Wind (Stagnation)
-    if pm25 > 35 and wind_kph < 5:
-        score += 20
-        alerts.append("⚠️ STAGNATION EVENT: Low wind + high pollution = air quality deteriorating rapidly")
-
-    # Noise Factor - Industrial/Traffic zones
-    if noise > 85:
-        score += 35
-        alerts.append(f"🔊 HAZARDOUS NOISE: {noise} dB - Hearing damage risk, use protection")
-    elif noise > 75:
-        score += 25
-        alerts.append(f"🔊 EXCESSIVE NOISE: {noise} dB - Prolonged exposure harmful (industrial/traffic zone)")
-    elif noise > 70:
-        score += 15
-        alerts.append(f"🔊 Elevated noise: {noise} dB - May cause stress and sleep disruption")
-
-    # CORRELATION LOGIC 4: Multiple factors (Compounding risk)
-    if pm25 > 35 and noise > 75:
-        score += 15
-        alerts.append("⚠️ MULTI-FACTOR ALERT: High pollution + noise exposure - Limit time in affected area")
-
-    # CORRELATION LOGIC 5: AQI + Temperature (Respiratory stress)
-    if aqi >= 3 and temp > 35:
-        score += 20
-        alerts.append("🌡️☢️ COMPOUND RISK: Poor air quality + extreme heat = severe respiratory stress")
-
-    # Specific recommendations based on risk level
-    if score >= 70:
-        alerts.append("🚨 RECOMMENDATION: STAY INDOORS. Close windows. Use air purification if available.")
-    elif score >= 50:
-        alerts.append("⚠️ RECOMMENDATION: Limit outdoor activities. Vulnerable groups stay indoors.")
-    elif score >= 30:
-        alerts.append("ℹ️ RECOMMENDATION: Monitor conditions. Reduce strenuous outdoor activities.")
-
-    # Return the score (capped at 100) and the contextual alerts
-    return min(score, 100), alerts
\ No newline at end of file
+    return get_rules().describe(code, data)
@@ -0,0 +1,201 @@
+"""
+Benchmark of history range scans on the epoch-ms schema.
+
+Fills a scratch database (data/schema.sql, via init_db) with synthetic
+readings spread over a number of days and cities, then times the range
+queries behind /api/history, /api/history/trend and the correlation
+endpoints and prints the plan SQLite picks for each.
+
+The same readings are also copied into history_iso, a table with the
+previous layout (ISO text timestamp and its indexes), and the raw range
+queries are timed on both tables so the two layouts can be compared.
+
+Usage (from backend/):
+    python scripts/bench_history_range.py [--rows 1000000] [--days 7] [--rounds 20]
+
+Nothing touches data/environmental.db; the scratch database lives in a
+temporary directory (or --db) and is removed afterwards unless --keep is set.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database  # noqa: E402
+
+CITIES = ["Kozhikode", "Kannur", "Kasaragod", "Thrissur", "Kochi"]
+
+def fill(rows, days, seed=1):
+    """Insert synthetic readings ending now, oldest first, and build the rollups"""
+    rng = random.Random(seed)
+    end = int(time.time() * 1000)
+    start = end - int(days * 86400 * 1000)
+    step = (end - start) / rows
+    conn = database.get_connection()
+    conn.executemany(
+        """
+        INSERT INTO history (ts, pm25, wind_kph, wind_dir, noise, risk_score, alert_triggered,
+                             location, sensor_id, temp_c, humidity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (int(start + i * step), rng.uniform(5, 150), rng.uniform(0, 30), "N",
+             rng.uniform(40, 90), score, score >= 50, CITIES[i % len(CITIES)], None,
+             rng.uniform(22, 36), rng.uniform(40, 95))
+            for i, score in ((i, rng.randint(0, 100)) for i in range(rows))
+        )
+    )
+    database._update_rollups(conn, 0)
+    conn.commit()
+    conn.execute("ANALYZE")
+    return datetime.fromtimestamp(end / 1000, timezone.utc)
+
+def fill_iso():
+    """Copy history into a table with the previous ISO-text timestamp layout"""
+    conn = database.get_connection()
+    conn.executescript("""
+        DROP TABLE IF EXISTS history_iso;
+        CREATE TABLE history_iso (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            pm25 REAL,
+            wind_kph REAL,
+            wind_dir TEXT,
+            noise REAL,
+            risk_score INTEGER,
+            alert_triggered BOOLEAN,
+            location TEXT,
+            sensor_id TEXT
+        );
+        INSERT INTO history_iso (timestamp, pm25, wind_kph, wind_dir, noise, risk_score,
+                                 alert_triggered, location, sensor_id)
+        SELECT strftime('%Y-%m-%dT%H:%M:%f', ts / 1000.0, 'unixepoch'), pm25, wind_kph, wind_dir,
+               noise, risk_score, alert_triggered, location, sensor_id
+        FROM history ORDER BY ts;
+        CREATE INDEX idx_iso_timestamp ON history_iso(timestamp);
+        CREATE INDEX idx_iso_location_time ON history_iso(location, timestamp);
+        CREATE INDEX idx_iso_location_sensor_time ON history_iso(location, sensor_id, timestamp);
+        ANALYZE;
+    """)
+    conn.commit()
+
+def iso_range_filter(since, until, location=None):
+    """_range_filter for history_iso: naive UTC ISO strings, as the old layout stored them"""
+    clauses = ["timestamp >= ?", "timestamp <= ?"]
+    params = [moment.astimezone(timezone.utc).replace(tzinfo=None).isoformat() for moment in (since, until)]
+    if location:
+        clauses.append("location = ?")
+        params.append(location)
+    return " AND ".join(clauses), params
+
+def layout_cases(day, week, now, city):
+    """(label, SQL template, range filter args) run against both layouts; {t} is the time column"""
+    return [
+        ("count, 1 day, all cities", "SELECT COUNT(*) FROM {table} WHERE {where}", (day, now)),
+        ("pm25 series, 1 day, one city",
+         "SELECT {t}, pm25 FROM {table} WHERE {where} ORDER BY {t}", (day, now, city)),
+        ("pm25 series, 7 days, one city",
+         "SELECT {t}, pm25 FROM {table} WHERE {where} ORDER BY {t}", (week, now, city)),
+        ("latest 24, one city",
+         "SELECT * FROM {table} WHERE {where} ORDER BY {t} DESC LIMIT 24", (week, now, city)),
+        ("avg pm25, 7 days, one city",
+         "SELECT AVG(pm25), MAX(pm25), AVG(noise) FROM {table} WHERE {where}", (week, now, city)),
+    ]
+
+def best_of(rounds, fn):
+    """Fastest of several runs of fn() in milliseconds, and its result"""
+    best, result = float("inf"), None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+def describe(result):
+    """Size of a query result for the report"""
+    if isinstance(result, dict):
+        return f"{len(result['data'])} points at {result['resolution']}"
+    if isinstance(result, list):
+        return f"{len(result)} rows"
+    return result
+
+def query_plan(sql, params):
+    rows = database.get_connection().execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return "; ".join(row[-1] for row in rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--db", help="Scratch database file (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database")
+    args = parser.parse_args()
+
+    scratch = None
+    if args.db:
+        database.DB_PATH = args.db
+    else:
+        scratch = tempfile.mkdtemp()
+        database.DB_PATH = os.path.join(scratch, "history_bench.db")
+    try:
+        database.init_db()
+        started = time.perf_counter()
+        now = fill(args.rows, args.days)
+        print(f"📏 {args.rows} readings over {args.days:g} day(s), "
+              f"{len(CITIES)} cities, filled in {time.perf_counter() - started:.1f}s")
+
+        day, week = now - timedelta(days=1), now - timedelta(days=min(7, args.days))
+        city = CITIES[-1]
+        cases = [
+            ("count, 1 day, all cities",
+             lambda: database.count_readings(day, now)),
+            ("pm25 series, 1 day, one city",
+             lambda: database.get_readings_between(day, now, city, columns=["ts", "pm25"])),
+            ("pm25 series, 7 days, one city",
+             lambda: database.get_readings_between(week, now, city, columns=["ts", "pm25"])),
+            ("latest 24, one city",
+             lambda: database.get_readings_between(week, now, city, limit=24, newest_first=True)),
+            ("trend, 7 days, all cities",
+             lambda: database.get_history_trend(week, now)),
+        ]
+        for label, fn in cases:
+            ms, result = best_of(args.rounds, fn)
+            print(f"{label:32s} {ms:9.2f} ms   ({describe(result)})")
+
+        started = time.perf_counter()
+        fill_iso()
+        print(f"\n📏 Copied into history_iso (ISO text layout) in {time.perf_counter() - started:.1f}s")
+        conn = database.get_connection()
+        print(f"{'raw SQL':32s} {'epoch ms':>9s}   {'ISO text':>9s}   ISO / epoch")
+        for label, template, range_args in layout_cases(day, week, now, city):
+            where, params = database._range_filter(*range_args)
+            epoch_sql = template.format(table="history", t="ts", where=where)
+            epoch_ms, epoch_rows = best_of(args.rounds, lambda: conn.execute(epoch_sql, params).fetchall())
+            iso_where, iso_params = iso_range_filter(*range_args)
+            iso_sql = template.format(table="history_iso", t="timestamp", where=iso_where)
+            iso_ms, iso_rows = best_of(args.rounds, lambda: conn.execute(iso_sql, iso_params).fetchall())
+            same = "" if len(epoch_rows) == len(iso_rows) else "   ❌ row counts differ"
+            print(f"{label:32s} {epoch_ms:9.2f}   {iso_ms:9.2f}   x{iso_ms / epoch_ms:.2f}{same}")
+
+        where, params = database._range_filter(week, now, city)
+        print("\nPlans:")
+        print(f"  count      {query_plan(f'SELECT COUNT(*) FROM history WHERE {where}', params)}")
+        print(f"  ts, pm25   {query_plan(f'SELECT ts, pm25 FROM history WHERE {where} ORDER BY ts', params)}")
+        where, params = iso_range_filter(week, now, city)
+        print(f"  ISO text   {query_plan(f'SELECT timestamp, pm25 FROM history_iso WHERE {where} ORDER BY timestamp', params)}")
+    finally:
+        database.close_connections()
+        if scratch and not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+        elif scratch:
+            print(f"\n🗂️  Kept {database.DB_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark of risk-rule evaluation cost per reading.
+
+Scores a set of fuzzed readings (values biased towards the rule thresholds)
+with calculate_risk one by one and with calculate_risk_batch in one pass,
+checks that both agree with each other and with the hand-written
+calculate_risk the rule table replaced (scripts/legacy_risk.py), and prints
+the cost per reading of all three.
+
+Usage (from backend/):
+    python scripts/bench_risk_rules.py [--readings 200000] [--rounds 3]
+
+The rule table is data/risk_rules.json unless RISK_RULES_PATH is set.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from risk_engine import (  # noqa: E402
+    calculate_risk, calculate_risk_batch, describe_alert_codes, readings_to_columns, RULES_PATH
+)
+from legacy_risk import calculate_risk as legacy_calculate_risk  # noqa: E402
+
+def fuzz_readings(n, seed=1):
+    """Random readings; about a third of the values sit on a rule threshold and some fields are missing"""
+    rng = random.Random(seed)
+
+    def pick(lo, hi, edges):
+        return rng.choice(edges) if rng.random() < 0.3 else rng.uniform(lo, hi)
+
+    readings = []
+    for _ in range(n):
+        data = {}
+        if rng.random() < 0.95:
+            data['pm25'] = pick(0, 120, [25, 35, 55])
+        if rng.random() < 0.95:
+            data['temp_c'] = pick(15, 45, [32, 35, 38])
+        if rng.random() < 0.95:
+            data['humidity'] = rng.choice([50, 75, 76, 85, 90, rng.randint(20, 100)])
+        if rng.random() < 0.95:
+            data['aqi'] = rng.randint(1, 6)
+        if rng.random() < 0.95:
+            data['wind_kph'] = pick(0, 40, [5, 10, 20])
+        if rng.random() < 0.95:
+            data['noise'] = rng.choice([70, 75, 85, rng.randint(40, 95)])
+        if rng.random() < 0.5:
+            data['wind_dir'] = 'SW'
+        readings.append(data)
+    return readings
+
+def best_of(rounds, fn):
+    """Fastest of several runs of fn(), in seconds"""
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--readings", type=int, default=200_000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    readings = fuzz_readings(args.readings)
+    print(f"📏 {len(readings)} readings, rules from {os.path.abspath(RULES_PATH)}")
+
+    scores, codes = calculate_risk_batch(readings_to_columns(readings))
+    mismatches = 0
+    for data, score, code in zip(readings, scores, codes):
+        if calculate_risk(data) != (int(score), describe_alert_codes(code, data)):
+            mismatches += 1
+    print(f"{'✅' if mismatches == 0 else '❌'} Scalar and batch results differ for {mismatches} reading(s)")
+    legacy_mismatches = sum(1 for data in readings if calculate_risk(data) != legacy_calculate_risk(data))
+    # Only meaningful for the shipped table, which encodes the legacy rules
+    print(f"{'✅' if legacy_mismatches == 0 else '⚠️ '} Rule table and legacy results differ for "
+          f"{legacy_mismatches} reading(s)")
+
+    legacy = best_of(args.rounds, lambda: [legacy_calculate_risk(data) for data in readings])
+    scalar = best_of(args.rounds, lambda: [calculate_risk(data) for data in readings])
+    columns = readings_to_columns(readings)
+    batch = best_of(args.rounds, lambda: calculate_risk_batch(columns))
+    to_columns = best_of(args.rounds, lambda: readings_to_columns(readings))
+
+    per_reading = lambda seconds: seconds / len(readings) * 1e6
+    print(f"legacy calculate_risk {per_reading(legacy):8.3f} us/reading")
+    print(f"calculate_risk        {per_reading(scalar):8.3f} us/reading   (x{scalar / legacy:.2f} of legacy)")
+    print(f"calculate_risk_batch  {per_reading(batch):8.3f} us/reading")
+    print(f"  + readings_to_columns {per_reading(to_columns):6.3f} us/reading")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Benchmark of response serialization: throughput and p99 latency per endpoint.
+
+Runs the app in-process (lifespan included) on a scratch copy of
+data/environmental.db filled with synthetic history and citizen reports, and
+sends sequential requests to the large JSON endpoints. The response cache is
+cleared before every request, so each response is built and serialized. Each
+endpoint is measured with orjson (when installed) and with the json module
+fallback of services.serialization.
+
+Usage (from backend/):
+    python scripts/bench_serialization.py [--requests 300] [--history 5000] [--reports 500]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+ENDPOINTS = (
+    "/api/history?limit=2000",
+    "/api/sensors",
+    "/api/citizen/reports?limit=500",
+)
+
+def fill(database, history, reports, seed=1):
+    """Add synthetic readings and citizen reports to the scratch database"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    database.log_readings([
+        ({
+            'timestamp': (now - timedelta(seconds=30 * i)).isoformat(),
+            'location': rng.choice(["Kozhikode", "Kannur", "Thrissur"]),
+            'pm25': rng.uniform(5, 150), 'wind_kph': rng.uniform(0, 30), 'wind_dir': "SW",
+            'noise': rng.uniform(40, 90), 'temp_c': rng.uniform(22, 36), 'humidity': rng.uniform(40, 95)
+        }, rng.randint(0, 100))
+        for i in range(history)
+    ])
+    database.flush_readings()
+    for i in range(reports):
+        database.submit_citizen_report({
+            'location': "Kozhikode", 'latitude': 11.25 + rng.uniform(-0.1, 0.1),
+            'longitude': 75.78 + rng.uniform(-0.1, 0.1), 'report_type': "smoke",
+            'severity': rng.choice(["low", "medium", "high"]),
+            'description': f"Synthetic report {i}: smoke near the industrial area",
+            'photo_path': None, 'citizen_name': "Bench", 'citizen_contact': None
+        })
+
+def measure(client, cache, url, count):
+    """Sequential requests with a cold response cache; returns (req/s, p99 ms, body bytes)"""
+    latencies, size = [], 0
+    started = time.perf_counter()
+    for _ in range(count):
+        cache.clear()
+        t0 = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - t0)
+        response.raise_for_status()
+        size = len(response.content)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return count / elapsed, p99 * 1000, size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--history", type=int, default=5000)
+    parser.add_argument("--reports", type=int, default=500)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    os.environ.setdefault("SIMULATOR_STATE_PATH", os.path.join(scratch, "simulator_state.db"))
+    import database
+    source = database.DB_PATH
+    database.DB_PATH = os.path.join(scratch, "environmental.db")
+    shutil.copy(source, database.DB_PATH)
+
+    from fastapi.testclient import TestClient
+    from services import serialization
+    import main as app_module
+
+    modes = [("json", None)]
+    if serialization.orjson is not None:
+        modes.insert(0, ("orjson", serialization.orjson))
+    else:
+        print("⚠️  orjson is not installed, measuring the json module only")
+
+    try:
+        with TestClient(app_module.app) as client:
+            fill(database, args.history, args.reports)
+            print(f"📏 {args.requests} requests per endpoint, "
+                  f"+{args.history} history rows, +{args.reports} reports")
+            print(f"{'endpoint':34s} {'body':>8s}  " + "  ".join(f"{name:>20s}" for name, _ in modes))
+            for url in ENDPOINTS:
+                cells, size = [], 0
+                for _, module in modes:
+                    serialization.orjson = module
+                    rate, p99, size = measure(client, app_module.response_cache, url, args.requests)
+                    cells.append(f"{rate:7.0f} req/s {p99:6.1f} ms")
+                print(f"{url:34s} {size / 1024:6.0f}KB  " + "  ".join(f"{c:>20s}" for c in cells))
+    finally:
+        serialization.orjson = modes[0][1]
+        shutil.rmtree(scratch, ignore_errors=True)
+    print("(columns: throughput, p99 latency)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Stress test of the shared simulator state under concurrent requests.
+
+Thread mode (default) runs the app in-process (lifespan included) on scratch
+copies of the databases and fires hundreds of concurrent requests from a
+thread pool: /api/sensors, /api/monitor and direct simulator updates, spread
+over the known cities. Process mode has several worker processes update the
+same city through the shared SQLite store at once.
+
+Both modes check that no simulator step is lost, that every request
+succeeds and (thread mode) that the registry's station metadata is never
+modified, and print the request latencies. The exit status is 1 if a check
+fails.
+
+Usage (from backend/):
+    python scripts/stress_simulator.py [--requests 600] [--threads 64]
+    python scripts/stress_simulator.py --processes 4 [--requests 800]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def report(label, latencies, elapsed):
+    print(f"{label}: {len(latencies)} in {elapsed:.2f}s, "
+          f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms, "
+          f"max {max(latencies) * 1000:.1f} ms")
+
+def run_threads(requests, threads):
+    """Concurrent requests against the in-process app"""
+    import database
+    source = database.DB_PATH
+    database.DB_PATH = os.path.join(os.environ["STRESS_SCRATCH"], "environmental.db")
+    shutil.copy(source, database.DB_PATH)
+
+    from fastapi.testclient import TestClient
+    from services import api_client
+    from services.sensor_registry import sensor_registry
+    import main
+
+    failures = []
+    with TestClient(main.app) as client:
+        stations = sensor_registry.stations() or ()
+        original = json.dumps([dict(s) for s in stations])
+        cities = sensor_registry.cities() or ["Kozhikode"]
+
+        def job(i):
+            started = time.perf_counter()
+            try:
+                if i % 3 == 0:
+                    response = client.get("/api/sensors")
+                    response.raise_for_status()
+                    body = response.json()
+                    assert body["count"] == len(body["sensors"]), "sensor count mismatch"
+                else:
+                    city = cities[(i // 3) % len(cities)]
+                    api_client.build_environmental_data(city)
+                    client.get(f"/api/monitor?city={city}").raise_for_status()
+            except Exception as e:
+                failures.append(repr(e))
+            return time.perf_counter() - started
+
+        before = {c: (api_client.get_city_state(c) or {}).get('update_count', 0) for c in cities}
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            latencies = list(pool.map(job, range(requests)))
+        elapsed = time.perf_counter() - started
+        after = {c: (api_client.get_city_state(c) or {}).get('update_count', 0) for c in cities}
+
+        report(f"{threads} threads", latencies, elapsed)
+        # The scheduler and sensor enrichment step cities too, so this is a lower bound
+        direct = sum(1 for i in range(requests) if i % 3)
+        steps = sum(after[c] - before[c] for c in cities)
+        print(f"{'✅' if steps >= direct else '❌'} {steps} simulator steps for {direct} direct updates")
+        if steps < direct:
+            failures.append(f"lost {direct - steps} simulator step(s)")
+        if json.dumps([dict(s) for s in stations]) != original:
+            failures.append("station metadata was modified")
+    return failures
+
+def _process_worker(city, count):
+    from services import api_client
+    for _ in range(count):
+        api_client.build_environmental_data(city)
+
+def run_processes(requests, processes):
+    """Updates of one city from several processes through the shared store"""
+    city = "Kozhikode"
+    per_process = requests // processes
+    workers = [
+        multiprocessing.Process(target=_process_worker, args=(city, per_process))
+        for _ in range(processes)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    from services import api_client
+    steps = (api_client.get_city_state(city) or {}).get('update_count', 0)
+    expected = per_process * processes
+    print(f"{processes} processes: {expected} updates in {elapsed:.2f}s")
+    print(f"{'✅' if steps == expected else '❌'} {steps} simulator steps for {expected} updates")
+    failures = [f"worker exited with {w.exitcode}" for w in workers if w.exitcode]
+    if steps != expected:
+        failures.append(f"lost {expected - steps} simulator step(s)")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Run the multi-process check with this many processes instead")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp()
+    # Every update steps the simulator, so lost updates show up in the counts
+    os.environ["STRESS_SCRATCH"] = scratch
+    os.environ["SIMULATOR_STATE_BACKEND"] = "sqlite"
+    os.environ["SIMULATOR_STATE_PATH"] = os.path.join(scratch, "simulator_state.db")
+    os.environ["SIMULATOR_STEP_INTERVAL"] = "0"
+    try:
+        if args.processes:
+            failures = run_processes(args.requests, args.processes)
+        else:
+            failures = run_threads(args.requests, args.threads)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    for failure in failures[:10]:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ No failures")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,213 @@
-import requests
+import asyncio
 import os
 import random
+import threading
+import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from services.weather_client import AsyncWeatherClient, WeatherAPIError
+from services.weather_cache import WeatherCache
+from services.shared_state import create_state_store
+from risk_engine import calculate_risk_batch
+
+# --- Weather Upstream ---
+# Shared async client (keep-alive pool) behind one per-city cache, so upstream
+# calls scale with the number of cities rather than with request rate.
+weather_client = AsyncWeatherClient(api_key=os.getenv("WEATHER_API_KEY"))
+weather_cache = WeatherCache()
+
+# --- Circuit Breaker ---
+WEATHER_BREAKER_THRESHOLD = int(os.getenv("WEATHER_BREAKER_THRESHOLD", "5"))
+WEATHER_BREAKER_RESET = float(os.getenv("WEATHER_BREAKER_RESET", "30"))
+WEATHER_NEGATIVE_TTL = float(os.getenv("WEATHER_NEGATIVE_TTL", "30"))
+
+class CircuitBreaker:
+    """
+    Fails fast once the upstream keeps failing.
+    
+    After failure_threshold consecutive failures the breaker opens and every
+    call is short-circuited. After reset_timeout seconds it goes half-open and
+    lets a single probe through: success closes it again, failure re-opens it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=WEATHER_BREAKER_THRESHOLD, reset_timeout=WEATHER_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.short_circuited = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go to the upstream right now"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.probe_started = None
+            if self.state == self.CLOSED:
+                return True
+            # Half-open: one probe at a time (a probe that never reported back is retried)
+            if self.state == self.HALF_OPEN and (
+                    self.probe_started is None or now - self.probe_started >= self.reset_timeout):
+                self.probe_started = now
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print("✅ Weather upstream recovered, circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"⚠️  Weather upstream failing, circuit open for {self.reset_timeout:.0f}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout': self.reset_timeout,
+                'short_circuited': self.short_circuited
+            }
+
+weather_breaker = CircuitBreaker()
+
+# Last successful observation per city, served while the upstream is unavailable
+_last_known_good = {}
+# city -> monotonic time of the last failed fetch (negative cache)
+_failed_at = {}
+
+def _skip_upstream(city):
+    """Whether to skip the upstream (recent failure for this city, or breaker open)"""
+    failed_at = _failed_at.get(city)
+    if failed_at is not None and time.monotonic() - failed_at < WEATHER_NEGATIVE_TTL:
+        return True
+    return not weather_breaker.allow()
+
+def _record_result(city, weather=None, error=None):
+    if error is None:
+        weather_breaker.record_success()
+        _failed_at.pop(city, None)
+        if weather is not None:
+            _last_known_good[city] = weather
+        return weather
+    
+    print(f"Weather API Error: {error}")
+    _failed_at[city] = time.monotonic()
+    # 4xx (e.g. unknown city) is the caller's problem, not an upstream outage
+    if not (isinstance(error, WeatherAPIError) and error.status_code < 500):
+        weather_breaker.record_failure()
+    return None
+
+def weather_upstream_status():
+    """Breaker state and fallback bookkeeping for the weather upstream"""
+    now = time.monotonic()
+    return {
+        'breaker': weather_breaker.snapshot(),
+        'negative_cached_cities': sorted(
+            # Copied first: other threads may add cities while this iterates
+            city for city, failed_at in _failed_at.copy().items() if now - failed_at < WEATHER_NEGATIVE_TTL
+        ),
+        'last_known_good_cities': len(_last_known_good)
+    }
+
 # --- City-Specific State Memory ---
-_city_states = {}
+# City trajectories and the enriched sensor network live in a state store
+# shared by every worker process, so all workers serve the same series.
+# Each step works on a private copy of the city's state, which is saved
+# atomically by the store, so concurrent requests never share a dict.
+simulator_state = create_state_store()
+# A city advances at most once per interval; callers in between (other
+# workers, the sensor map) get its current readings
+SIMULATOR_STEP_INTERVAL = float(os.getenv("SIMULATOR_STEP_INTERVAL", "4"))
 
 # --- CACHING SYSTEM ---
-_sensor_cache = {
-    'data': None,
-    'timestamp': None,
-    'ttl': 4
-}
+SENSOR_CACHE_TTL = 4
 
-def get_city_state(city):
+def new_city_state(city):
     """Initialize state with stable starting values."""
-    if city not in _city_states:
-        _city_states[city] = {
-            'pm25': random.uniform(25, 35),      # Start in "Moderate" range
-            'noise': random.uniform(55, 65),     # Start in "Normal" range
-            'wind': 12.0,
-            # Trend Tracking - NOW WITH MORE MOVEMENT
-            'pm25_target': 30.0,
-            'noise_target': 60.0,
-            'wind_target': 12.0,
-            'trend_duration': 0,
-            'update_count': 0  # Track updates for periodic shifts
+    return {
+        'city': city,
+        'pm25': random.uniform(25, 35),      # Start in "Moderate" range
+        'noise': random.uniform(55, 65),     # Start in "Normal" range
+        'wind': 12.0,
+        # Trend Tracking - NOW WITH MORE MOVEMENT
+        'pm25_target': 30.0,
+        'noise_target': 60.0,
+        'wind_target': 12.0,
+        'trend_duration': 0,
+        'update_count': 0,  # Track updates for periodic shifts
+        'stepped_at': 0,
+        'reading': None
+    }
+
+def get_city_state(city):
+    """Current shared state of a city, or None before its first reading"""
+    return simulator_state.get('city', city)
+
+def advance_city_state(state, city, now):
+    """
+    Step a city's trajectories once, unless it was stepped less than
+    SIMULATOR_STEP_INTERVAL seconds ago
+
+    Args:
+        state (dict): Stored state, or None for a new city
+        city (str): City name
+        now (float): Current epoch seconds
+
+    Returns:
+        dict: The updated state; state['reading'] holds the latest readings
+    """
+    if state is None:
+        state = new_city_state(city)
+    if state['reading'] is None or now - state['stepped_at'] >= SIMULATOR_STEP_INTERVAL:
+        # Increment update counter
+        state['update_count'] += 1
+        state['reading'] = {
+            'wind_kph': generate_smooth_wind(state),
+            'pm25': generate_smooth_pm25(state),
+            'noise': generate_smooth_noise(state)
         }
-    return _city_states[city]
+        state['stepped_at'] = now
+    return state
 
-def fetch_environmental_data(city="Thiruvananthapuram"):
-    state = get_city_state(city)
-    
-    # Increment update counter
-    state['update_count'] += 1
+async def _fetch_weather_upstream_async(city):
+    if not weather_client.api_key or _skip_upstream(city):
+        return None
+    try:
+        return _record_result(city, await weather_client.fetch(city))
+    except Exception as e:
+        return _record_result(city, error=e)
+
+async def fetch_weather_async(city):
+    """Cached weather for async callers; last-known-good or None if unavailable"""
+    return await weather_cache.aget_or_fetch(city, _fetch_weather_upstream_async) or _last_known_good.get(city)
+
+def build_environmental_data(city, weather=None):
+    """Combine real weather (if any) with the simulated PM2.5/wind/noise readings"""
+    # The clock is read under the store's lock, so steps are ordered by time
+    state = simulator_state.update('city', city, lambda s: advance_city_state(s, city, time.time()))
     
     data = {
         "location": city,
@@ -50,27 +221,37 @@ def fetch_environmental_data(city="Thiruvananthapuram"):
         "timestamp": datetime.now().isoformat()
     }
 
-    # Fetch Real Weather (Temperature/Humidity/Wind Dir only)
-    weather_key = os.getenv("WEATHER_API_KEY")
-    if weather_key:
-        try:
-            w_url = f"http://api.weatherapi.com/v1/current.json?key={weather_key}&q={city}&aqi=yes"
-            response = requests.get(w_url, timeout=3)
-            if response.status_code == 200:
-                wx = response.json()
-                data['wind_dir'] = wx['current']['wind_dir']
-                data['temp_c'] = wx['current']['temp_c']
-                data['humidity'] = wx['current']['humidity']
-        except Exception as e:
-            print(f"Weather API Error: {e}")
+    # Real Weather (Temperature/Humidity/Wind Dir only)
+    if weather:
+        data.update(weather)
 
     # --- SMOOTH BUT VISIBLE DYNAMIC DATA ---
-    data['wind_kph'] = generate_smooth_wind(state)
-    data['pm25'] = generate_smooth_pm25(state)
-    data['noise'] = generate_smooth_noise(state)
+    data.update(state['reading'])
     
     return data
 
+# The simulator state store blocks (the sqlite backend waits on its write
+# lock), so the async entry points below run every store call in a thread
+# and keep the event loop free.
+
+async def fetch_environmental_data_async(city="Thiruvananthapuram"):
+    """Simulated readings for a city, combined with its cached upstream weather"""
+    weather = await fetch_weather_async(city)
+    return await asyncio.to_thread(build_environmental_data, city, weather)
+
+async def fetch_environmental_data_many(cities):
+    """
+    Fetch readings for several cities, with all weather calls made concurrently.
+    
+    Returns:
+        dict: city -> environmental data
+    """
+    unique = list(dict.fromkeys(cities))
+    weather = await asyncio.gather(*(fetch_weather_async(city) for city in unique))
+    return await asyncio.to_thread(
+        lambda: {city: build_environmental_data(city, wx) for city, wx in zip(unique, weather)}
+    )
+
 # --- ENHANCED SMOOTH GENERATORS (More Visible Changes) ---
 
 def generate_smooth_pm25(state):
@@ -187,27 +368,32 @@ SENSOR_PROFILES = {
     "environmental": {"pm25_multiplier": 0.6, "pm25_offset": -10, "noise_offset": -10}
 }
 
-def enrich_sensor_network(sensors_list):
-    """
-    Injects live data into map pins.
-    """
-    now = datetime.now()
-    if (_sensor_cache['data'] is not None and 
-        _sensor_cache['timestamp'] is not None):
-        time_diff = (now - _sensor_cache['timestamp']).total_seconds()
-        if time_diff < _sensor_cache['ttl']:
-            return _sensor_cache['data']
-    
+# The shared network is a large value, so each process keeps the last one it
+# decoded and only reads it again when the small 'network_meta' entry changes.
+# The decoded list is shared by readers in this process and must not be modified.
+_decoded_network = {'entry': (None, None)}  # (timestamp, data), replaced as a whole
+
+def _cached_sensors(now, version):
+    meta = simulator_state.get('sensors', 'network_meta')
+    if meta is None or meta.get('version') != version or now - meta['timestamp'] >= SENSOR_CACHE_TTL:
+        return None
+    timestamp, data = _decoded_network['entry']
+    if timestamp != meta['timestamp']:
+        cached = simulator_state.get('sensors', 'network')
+        if cached is None or cached['timestamp'] != meta['timestamp']:
+            return None
+        timestamp, data = cached['timestamp'], cached['data']
+        _decoded_network['entry'] = (timestamp, data)
+    return data
+
+def _apply_baselines(sensors_list, baselines, now, version):
+    """Live readings for every station, as new dicts (sensors_list is left as it is)"""
     enriched_sensors = []
-    region_weather_cache = {}
 
-    for sensor in sensors_list:
+    for station in sensors_list:
+        sensor = dict(station)
         city = sensor.get("location", "Thiruvananthapuram")
-        
-        if city not in region_weather_cache:
-            region_weather_cache[city] = fetch_environmental_data(city)
-            
-        baseline = region_weather_cache[city]
+        baseline = baselines[city]
         stype = sensor.get("type", "residential")
         profile = SENSOR_PROFILES.get(stype, SENSOR_PROFILES["residential"])
         
@@ -233,7 +419,46 @@ def enrich_sensor_network(sensors_list):
             
         enriched_sensors.append(sensor)
     
-    _sensor_cache['data'] = enriched_sensors
-    _sensor_cache['timestamp'] = now
+    # Score every station in one vectorized pass
+    scores, _ = calculate_risk_batch({
+        'pm25': [s["pm25"] for s in enriched_sensors],
+        'noise': [s["noise"] for s in enriched_sensors],
+        'temp_c': [s["temp"] for s in enriched_sensors],
+        'wind_kph': [s["wind_kph"] for s in enriched_sensors],
+        'humidity': [baselines[s.get("location", "Thiruvananthapuram")].get("humidity", 60) for s in enriched_sensors],
+        'aqi': [baselines[s.get("location", "Thiruvananthapuram")].get("aqi", 1) for s in enriched_sensors],
+    })
+    for sensor, score in zip(enriched_sensors, scores):
+        sensor["risk_score"] = int(score)
+    
+    # Data first: a reader that sees the new meta always finds the matching data
+    simulator_state.put('sensors', 'network', {'data': enriched_sensors, 'timestamp': now, 'version': version})
+    simulator_state.put('sensors', 'network_meta', {'timestamp': now, 'version': version})
+    
+    return enriched_sensors
+
+def sensor_network_version():
+    """Changes whenever the enriched sensor network is recomputed"""
+    meta = simulator_state.get('sensors', 'network_meta')
+    return meta['timestamp'] if meta is not None else None
+
+def _sensor_cities(sensors_list):
+    return [sensor.get("location", "Thiruvananthapuram") for sensor in sensors_list]
+
+async def enrich_sensor_network_async(sensors_list, version=None):
+    """
+    Live readings for map pins, as new dicts built from the station metadata.
+    Every city is fetched in parallel.
+
+    Args:
+        sensors_list (list): Station mappings (not modified)
+        version: Version of the station list; a cached network built from
+            another version is not reused
+    """
+    now = time.time()
+    cached = await asyncio.to_thread(_cached_sensors, now, version)
+    if cached is not None:
+        return cached
     
-    return enriched_sensors
\ No newline at end of file
+    baselines = await fetch_environmental_data_many(_sensor_cities(sensors_list))
+    return await asyncio.to_thread(_apply_baselines, sensors_list, baselines, now, version)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+
+# Events buffered per subscriber before the oldest ones are dropped
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "32"))
+# Seconds between keep-alive comments on an idle stream
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))
+
+def format_sse(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+class Subscription:
+    """One connected client: a bounded queue of pre-encoded SSE messages"""
+
+    def __init__(self, city=None, maxsize=STREAM_QUEUE_SIZE):
+        self.city = city
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def wants(self, city, exact=False):
+        if exact:
+            return self.city == city
+        return city is None or self.city is None or self.city == city
+
+    def push(self, message):
+        """
+        Enqueue without ever blocking the producer.
+        
+        A slow client that falls behind loses its oldest messages, not the
+        newest ones, so it always catches up to the current state.
+        """
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except asyncio.QueueFull:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+
+class Broadcaster:
+    """
+    Fans out events from one producer to many SSE subscribers.
+    
+    Each event is encoded once and shared by every subscriber it goes to.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self.published = 0
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, city=None):
+        subscription = Subscription(city)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscribers.discard(subscription)
+
+    def subscribed_cities(self):
+        """Cities with at least one subscriber; None stands for unscoped subscribers"""
+        return {subscription.city for subscription in self._subscribers}
+
+    def publish(self, event, data, city=None, exact=False):
+        """
+        Send an event to every subscriber interested in the city.
+        
+        Args:
+            event (str): SSE event name
+            data: JSON-serializable payload
+            city (str): City the event belongs to, None for all subscribers
+            exact (bool): Only subscribers scoped to exactly this city
+                (with city=None: only unscoped subscribers)
+        """
+        if not self._subscribers:
+            return
+        message = format_sse(event, data)
+        for subscription in list(self._subscribers):
+            if subscription.wants(city, exact):
+                subscription.push(message)
+        self.published += 1
+
+    async def stream(self, subscription, initial=(), is_disconnected=None):
+        """
+        Async generator of SSE bytes for one subscriber.
+        
+        Args:
+            subscription (Subscription): From subscribe(); released when the stream ends
+            initial (iterable): Already-encoded messages to send first
+            is_disconnected (callable): Awaitable check used to stop on client disconnect
+        """
+        try:
+            for message in initial:
+                yield message
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        break
+                    message = b": keep-alive\n\n"
+                yield message
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'published': self.published,
+            'dropped': sum(s.dropped for s in self._subscribers)
+        }
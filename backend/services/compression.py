@@ -0,0 +1,121 @@
+import gzip
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+# Brotli is optional (pip install Brotli); without it only gzip is offered
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as they are
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "5"))
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/octet-stream")
+
+def available_encodings():
+    """Encodings this server can produce, most preferred first"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+def choose_encoding(accept_encoding):
+    """
+    Pick a content coding from an Accept-Encoding header
+
+    Args:
+        accept_encoding (str): Header value, e.g. "gzip, deflate, br;q=0.9"
+
+    Returns:
+        str: "br", "gzip" or None for identity
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in available_encodings():
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def compress(body, encoding):
+    """Compress a body with "br" or "gzip" at the configured level"""
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+class CompressionMiddleware:
+    """
+    Compresses complete text/JSON responses of at least minimum_size bytes.
+
+    Unlike Starlette's GZipMiddleware it leaves streamed responses alone, so
+    Server-Sent Events are not held back in a compressor buffer, and it
+    passes through responses that already carry a Content-Encoding (the
+    pre-compressed bodies of the response cache).
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                passthrough = (
+                    "content-encoding" in headers
+                    or not is_compressible(headers.get("content-type", ""))
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    # Held back until the body shows whether to compress
+                    start_message = message
+                return
+            if passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(raw=start["headers"])
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("Accept-Encoding")
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    passthrough = True
+                else:
+                    body = compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+                await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,360 @@
+import os
+import threading
+from collections import deque
+from itertools import combinations
+
+import numpy as np
+
+# Metrics correlated pairwise; short names are used in the pair keys ("pm25_wind")
+CORRELATION_METRICS = {
+    'pm25': 'pm25',
+    'wind_kph': 'wind',
+    'noise': 'noise',
+}
+# Sliding windows (in readings) kept for every city, e.g. "24,1000"
+CORRELATION_WINDOWS = tuple(
+    int(w) for w in os.getenv("CORRELATION_WINDOWS", "24,1000").split(",") if w.strip()
+)
+DEFAULT_WINDOW = CORRELATION_WINDOWS[0]
+# Numeric history columns covered by the full correlation matrix
+MATRIX_COLUMNS = ('pm25', 'wind_kph', 'noise', 'risk_score', 'temp_c', 'humidity')
+# Upper bounds for lagged cross-correlation requests: grid points per series
+# (hours * 3600 / step_seconds) and the largest shift tried, in steps
+LAGGED_MAX_POINTS = int(os.getenv("LAGGED_MAX_POINTS", "10000"))
+LAGGED_MAX_LAG = int(os.getenv("LAGGED_MAX_LAG", "288"))
+
+class PairStats:
+    """
+    Running means and co-moments of one metric pair (Welford's method)
+
+    Only readings where both metrics are present are counted, so the two
+    series always come from the same rows.
+    """
+
+    __slots__ = ('n', 'mean_x', 'mean_y', 'm2_x', 'm2_y', 'c_xy')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean_x = self.mean_y = 0.0
+        self.m2_x = self.m2_y = self.c_xy = 0.0
+
+    def add(self, x, y):
+        self.n += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.n
+        self.mean_y += dy / self.n
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+        self.c_xy += dx * (y - self.mean_y)
+
+    def remove(self, x, y):
+        """Inverse of add, for a pair that was added earlier"""
+        if self.n <= 1:
+            self.reset()
+            return
+        old_mean_x, old_mean_y = self.mean_x, self.mean_y
+        self.n -= 1
+        self.mean_x = old_mean_x + (old_mean_x - x) / self.n
+        self.mean_y = old_mean_y + (old_mean_y - y) / self.n
+        dx = x - self.mean_x
+        self.m2_x -= dx * (x - old_mean_x)
+        self.m2_y -= (y - self.mean_y) * (y - old_mean_y)
+        self.c_xy -= dx * (y - old_mean_y)
+
+    def pearson(self):
+        if self.n < 2:
+            return 0.0
+        # Rounding left over from removals must not read as variance
+        eps = 1e-12 * self.n
+        if self.m2_x <= eps * (1.0 + self.mean_x ** 2) or self.m2_y <= eps * (1.0 + self.mean_y ** 2):
+            return 0.0
+        r = self.c_xy / (self.m2_x * self.m2_y) ** 0.5
+        # Rounding can push a perfect correlation just past +-1
+        return max(-1.0, min(1.0, r))
+
+class RollingCorrelation:
+    """
+    Pearson correlations of every metric pair over the last `window` readings
+
+    Each reading costs O(1): it is added to the running co-moments and the
+    reading falling out of the window is subtracted again. To keep floating
+    point drift from building up over long runs, the sums are recomputed from
+    the window once every `window` evictions (amortized O(1) as well).
+    """
+
+    def __init__(self, window, metrics=CORRELATION_METRICS):
+        self.window = window
+        self.metrics = tuple(metrics)
+        self.names = {
+            f"{metrics[a]}_{metrics[b]}": (i, j)
+            for (i, a), (j, b) in combinations(enumerate(self.metrics), 2)
+        }
+        self.pairs = {name: PairStats() for name in self.names}
+        self.readings = deque()
+        self._evictions = 0
+
+    def _apply(self, values, update):
+        for name, (i, j) in self.names.items():
+            x, y = values[i], values[j]
+            if x is not None and y is not None:
+                update(self.pairs[name], x, y)
+
+    def add(self, reading):
+        """
+        Slide the window forward by one reading
+
+        Args:
+            reading (dict): Reading with the metric keys; missing/None values
+                leave the pairs that need them untouched
+        """
+        values = tuple(reading.get(m) for m in self.metrics)
+        self.readings.append(values)
+        self._apply(values, PairStats.add)
+        if len(self.readings) > self.window:
+            self._apply(self.readings.popleft(), PairStats.remove)
+            self._evictions += 1
+            if self._evictions >= self.window:
+                self._recompute()
+
+    def _recompute(self):
+        for stats in self.pairs.values():
+            stats.reset()
+        for values in self.readings:
+            self._apply(values, PairStats.add)
+        self._evictions = 0
+
+    @property
+    def sample_size(self):
+        return len(self.readings)
+
+    def correlations(self):
+        return {name: round(stats.pearson(), 3) for name, stats in self.pairs.items()}
+
+class CorrelationEngine:
+    """
+    Rolling correlations per city (and across all cities) for every window
+
+    State for a city is created on first request by seeding it from stored
+    history through `loader(city, limit)` (newest first, like get_history);
+    after that every sampled reading is folded in as it arrives. Readings for
+    cities nobody asked about yet are skipped, since seeding picks them up
+    from the database later. Only cities accepted by `is_known(city)` get
+    state, so arbitrary names cannot grow it.
+    """
+
+    def __init__(self, loader, windows=CORRELATION_WINDOWS, is_known=None):
+        self.loader = loader
+        self.windows = tuple(sorted(set(windows)))
+        self.is_known = is_known or (lambda city: True)
+        self._states = {}
+        self._lock = threading.Lock()
+        # Bumped on every change, so callers can cache what they derive
+        self.version = 0
+
+    def _seed(self, city):
+        records = self.loader(city, max(self.windows))
+        states = {w: RollingCorrelation(w) for w in self.windows}
+        for record in reversed(records):
+            for state in states.values():
+                state.add(record)
+        return states
+
+    def _states_for(self, city):
+        with self._lock:
+            states = self._states.get(city)
+        if states is None:
+            if city is not None and not self.is_known(city):
+                return None
+            # Load outside the lock so sampling is never blocked on the database
+            seeded = self._seed(city)
+            with self._lock:
+                if city not in self._states:
+                    self._states[city] = seeded
+                    self.version += 1
+                states = self._states[city]
+        return states
+
+    def warm(self, cities):
+        """Seed state for the given cities (None: all cities) ahead of requests; unknown cities are skipped"""
+        for city in cities:
+            self._states_for(city)
+
+    def add(self, reading):
+        """Fold one reading into its city's windows and the all-city windows"""
+        with self._lock:
+            for city in (reading.get('location'), None):
+                for state in self._states.get(city, {}).values():
+                    state.add(reading)
+            self.version += 1
+
+    def get(self, city=None, window=DEFAULT_WINDOW):
+        """
+        Current correlations for a city
+
+        Args:
+            city (str): City, or None for all cities together
+            window (int): One of the configured windows
+
+        Returns:
+            dict: correlations (pair -> coefficient) and sample_size, or None
+                for a city rejected by is_known
+        """
+        if window not in self.windows:
+            raise ValueError(f"window must be one of {list(self.windows)}")
+        states = self._states_for(city)
+        if states is None:
+            return None
+        state = states[window]
+        with self._lock:
+            return {
+                'correlations': state.correlations(),
+                'sample_size': state.sample_size
+            }
+
+# --- BATCH ANALYSIS ---
+# Vectorized counterparts for arbitrary slices of history. Missing values are
+# NaN and handled by pairwise deletion: every coefficient uses exactly the rows
+# where both of its series are present.
+
+def to_matrix(records, columns=MATRIX_COLUMNS):
+    """Rows of reading dicts as an (n, k) float array, None -> NaN"""
+    return np.array(
+        [[np.nan if r.get(c) is None else r[c] for c in columns] for r in records],
+        dtype=float
+    ).reshape(len(records), len(columns))
+
+def correlation_matrix(records, columns=MATRIX_COLUMNS, min_periods=2):
+    """
+    Pearson correlation of every pair of columns, aligned by row
+
+    All pairs are computed at once from masked matrix products, so the cost
+    is one pass over the data no matter how many columns there are.
+
+    Args:
+        records (list): Reading dictionaries (e.g. from get_history)
+        columns (tuple): Numeric keys to correlate
+        min_periods (int): Fewest shared rows a pair needs for a coefficient
+
+    Returns:
+        dict: columns, matrix (k x k, None where undefined) and counts (rows
+            shared by each pair)
+    """
+    x = to_matrix(records, columns)
+    present = ~np.isnan(x)
+    m = present.astype(float)
+    # Centering on the column mean keeps the sums small, so subtracting them
+    # does not cancel away the variance of large-valued series
+    counts = present.sum(axis=0)
+    means = np.where(present, x, 0.0).sum(axis=0) / np.maximum(counts, 1)
+    x0 = np.where(present, x - means, 0.0)
+
+    n = m.T @ m                   # rows shared by columns i and j
+    sx = x0.T @ m                 # sum of column i over rows where j is present
+    sxx = (x0 * x0).T @ m         # sum of squares of column i, same rows
+    sxy = x0.T @ x0               # cross products over shared rows
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sx.T / n
+        var_x = sxx - sx * sx / n
+        r = cov / np.sqrt(var_x * var_x.T)
+    # A variance that is only rounding left over from the subtraction is zero
+    flat = var_x <= 1e-10 * sxx
+    undefined = (n < min_periods) | flat | flat.T
+    r = np.clip(r, -1.0, 1.0)
+
+    matrix = [
+        [None if undefined[i, j] else round(float(r[i, j]), 3) for j in range(len(columns))]
+        for i in range(len(columns))
+    ]
+    return {
+        'columns': list(columns),
+        'matrix': matrix,
+        'counts': n.astype(int).tolist()
+    }
+
+def time_grid(records, column, start_ms, end_ms, step_ms):
+    """
+    Resample one column onto a regular time grid (mean per step, NaN if empty)
+
+    Series from different cities or sensors are aligned by timestamp this way
+    before they are compared.
+
+    Args:
+        records (list): Reading dictionaries with 'ts' (epoch ms)
+        column (str): Key to resample
+        start_ms, end_ms (int): Grid bounds (inclusive)
+        step_ms (int): Grid spacing
+
+    Returns:
+        np.ndarray: One value per step
+    """
+    size = int((end_ms - start_ms) // step_ms) + 1
+    if not records:
+        return np.full(size, np.nan)
+    ts = np.array([r['ts'] for r in records], dtype=np.int64)
+    values = to_matrix(records, (column,))[:, 0]
+    keep = ~np.isnan(values) & (ts >= start_ms) & (ts <= end_ms)
+    idx = (ts[keep] - start_ms) // step_ms
+    sums = np.bincount(idx, weights=values[keep], minlength=size)
+    counts = np.bincount(idx, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def _pearson(x, y, min_periods):
+    both = ~(np.isnan(x) | np.isnan(y))
+    n = int(both.sum())
+    if n < min_periods:
+        return None, n
+    dx = x[both] - x[both].mean()
+    dy = y[both] - y[both].mean()
+    var_x, var_y = float(dx @ dx), float(dy @ dy)
+    if var_x <= 1e-10 * float(x[both] @ x[both]) or var_y <= 1e-10 * float(y[both] @ y[both]):
+        return None, n
+    return max(-1.0, min(1.0, float(dx @ dy) / (var_x * var_y) ** 0.5)), n
+
+def lagged_cross_correlation(x, y, max_lag, min_periods=3):
+    """
+    Correlation of x against y shifted by -max_lag..max_lag steps
+
+    A peak at a positive lag k means changes in x show up in y k steps later,
+    i.e. x leads y - the typical signature of pollution travelling from the
+    place x was measured to the place y was measured.
+
+    Args:
+        x, y (array): Series on the same time grid (NaN for gaps)
+        max_lag (int): Largest shift to try, in grid steps
+        min_periods (int): Fewest overlapping points a lag needs
+
+    Returns:
+        dict: lags, correlations (None where undefined), counts, and best_lag
+            / best_correlation for the strongest absolute correlation
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    size = min(len(x), len(y))
+    x, y = x[:size], y[:size]
+    max_lag = max(0, min(int(max_lag), size - 1))
+
+    lags = list(range(-max_lag, max_lag + 1))
+    correlations, counts = [], []
+    for k in lags:
+        if k >= 0:
+            r, n = _pearson(x[:size - k], y[k:], min_periods)
+        else:
+            r, n = _pearson(x[-k:], y[:size + k], min_periods)
+        correlations.append(None if r is None else round(r, 3))
+        counts.append(n)
+
+    defined = [(abs(r), k, r) for k, r in zip(lags, correlations) if r is not None]
+    best = max(defined, key=lambda item: (item[0], -abs(item[1]))) if defined else None
+    return {
+        'lags': lags,
+        'correlations': correlations,
+        'counts': counts,
+        'best_lag': best[1] if best else None,
+        'best_correlation': best[2] if best else None
+    }
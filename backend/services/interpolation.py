@@ -0,0 +1,290 @@
+import math
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from services.spatial_index import KM_PER_DEGREE, haversine_km
+
+# Metrics interpolated over the map
+GRID_METRICS = ('pm25', 'noise')
+# Grid spacing in degrees (0.01 deg is about 1.1 km)
+IDW_GRID_STEP_DEG = float(os.getenv("IDW_GRID_STEP_DEG", "0.01"))
+IDW_POWER = float(os.getenv("IDW_POWER", "2"))
+# Stations further than this from a cell do not contribute to it; cells with
+# no station in range have no value (drawn transparent)
+IDW_RADIUS_KM = float(os.getenv("IDW_RADIUS_KM", "25"))
+# Each cell is interpolated from at most this many of its nearest stations
+IDW_NEIGHBOURS = int(os.getenv("IDW_NEIGHBOURS", "12"))
+# Cells computed together in one vectorized block (per side)
+IDW_BLOCK = 16
+TILE_SIZE = 256
+TILE_ALPHA = int(os.getenv("GRID_TILE_ALPHA", "150"))
+# Rendered tiles and grid crops kept per sensor tick; a panning map asks for
+# many distinct ones, so they get a cache of their own
+GRID_CACHE_SIZE = int(os.getenv("GRID_CACHE_SIZE", "1024"))
+
+# Colour stops (value, (r, g, b)); values in between are blended
+COLOR_SCALES = {
+    'pm25': ((0, (0, 228, 0)), (12, (0, 228, 0)), (35, (255, 255, 0)), (55, (255, 126, 0)),
+             (150, (255, 0, 0)), (250, (143, 63, 151))),
+    'noise': ((40, (0, 228, 0)), (55, (255, 255, 0)), (70, (255, 126, 0)), (85, (255, 0, 0)),
+              (100, (143, 63, 151))),
+}
+
+def idw(cell_lats, cell_lngs, lats, lngs, values, power=IDW_POWER, radius_km=IDW_RADIUS_KM,
+        neighbours=IDW_NEIGHBOURS):
+    """
+    Inverse-distance weighted values for a block of grid cells
+
+    Distances use an equirectangular approximation, which is accurate to well
+    under a percent at the scale of the radius. Neighbours are picked once
+    and shared by all metrics; a station missing a metric (NaN) just does
+    not count towards that metric.
+
+    Args:
+        cell_lats (array): Latitudes of the block's rows
+        cell_lngs (array): Longitudes of the block's columns
+        lats, lngs (array): Station coordinates, shape (n,)
+        values (array): Station readings, shape (n, metrics)
+        power (float): Distance exponent
+        radius_km (float): Stations beyond this distance are ignored
+        neighbours (int): Use only this many nearest stations per cell
+
+    Returns:
+        np.ndarray: (rows, cols, metrics) values, NaN where no station is in range
+    """
+    # Squared distances, split by axis: (rows, 1, n) + (rows, cols, n)
+    dy = (cell_lats[:, None] - lats[None, :]) * KM_PER_DEGREE
+    kx = KM_PER_DEGREE * np.cos(np.radians(cell_lats))[:, None, None]
+    dx = (cell_lngs[None, :, None] - lngs[None, None, :]) * kx
+    d2 = dx * dx
+    d2 += (dy * dy)[:, None, :]
+    # A cell on top of a station takes (almost exactly) the station's value
+    np.maximum(d2, 1e-12, out=d2)
+    if neighbours and d2.shape[2] > neighbours:
+        nearest = np.argpartition(d2, neighbours - 1, axis=2)[..., :neighbours]
+        d2 = np.take_along_axis(d2, nearest, axis=2)
+        values = values[nearest]
+    else:
+        values = np.broadcast_to(values, d2.shape + values.shape[-1:])
+    weights = 1.0 / d2 if power == 2 else d2 ** (-power / 2)
+    weights[d2 > radius_km * radius_km] = 0.0
+    present = ~np.isnan(values)
+    total = np.einsum('rck,rckm->rcm', weights, present.astype(float))
+    weighted = np.einsum('rck,rckm->rcm', weights, np.where(present, values, 0.0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, weighted / total, np.nan)
+
+class PollutionGrid:
+    """
+    Interpolated readings on a regular lat/lng grid
+
+    Row 0 is the southernmost row and column 0 the westernmost column; cell
+    (i, j) is centred on (south + i * step, west + j * step).
+    """
+
+    def __init__(self, south, west, step, values):
+        self.south = south
+        self.west = west
+        self.step = step
+        self.values = values  # metric -> (rows, cols) float32 array
+        self.rows, self.cols = next(iter(values.values())).shape
+
+    @property
+    def bounds(self):
+        """(south, west, north, east) of the cell centres"""
+        return (self.south, self.west,
+                self.south + (self.rows - 1) * self.step, self.west + (self.cols - 1) * self.step)
+
+    def sample(self, metric, lats, lngs):
+        """Value of the nearest cell for each point (NaN outside the grid)"""
+        i, j = np.broadcast_arrays(
+            np.rint((np.asarray(lats) - self.south) / self.step).astype(np.int64),
+            np.rint((np.asarray(lngs) - self.west) / self.step).astype(np.int64)
+        )
+        inside = (i >= 0) & (i < self.rows) & (j >= 0) & (j < self.cols)
+        out = np.full(i.shape, np.nan, dtype=np.float32)
+        out[inside] = self.values[metric][i[inside], j[inside]]
+        return out
+
+    def crop(self, metric, south, west, north, east, stride=1):
+        """
+        Cells inside a bounding box, every `stride`-th row and column
+
+        Returns:
+            tuple: (values, south, west, step) of the cropped grid; values
+                is empty (0 x 0) when the box does not overlap the grid
+        """
+        i0 = max(0, math.ceil((south - self.south) / self.step))
+        j0 = max(0, math.ceil((west - self.west) / self.step))
+        i1 = min(self.rows - 1, math.floor((north - self.south) / self.step))
+        j1 = min(self.cols - 1, math.floor((east - self.west) / self.step))
+        if i1 < i0 or j1 < j0:
+            # Negative ends would slice from the end of the array
+            return np.empty((0, 0), dtype=np.float32), south, west, self.step * stride
+        values = self.values[metric][i0:i1 + 1:stride, j0:j1 + 1:stride]
+        return values, self.south + i0 * self.step, self.west + j0 * self.step, self.step * stride
+
+def build_grid(readings, index, metrics=GRID_METRICS, step=IDW_GRID_STEP_DEG,
+               radius_km=IDW_RADIUS_KM, power=IDW_POWER):
+    """
+    Interpolate readings over a grid covering every station plus the radius
+
+    The grid is processed in small blocks, each against only the stations
+    that can be among its cells' nearest neighbours: if the block centre's
+    k-th nearest station is d km away and the block's half-diagonal is h,
+    every cell has k stations within d + h, all of them within d + 2h of the
+    centre. Work therefore grows with the number of cells, not the network
+    size.
+
+    Args:
+        readings (list): Live station readings, in the order the index was built
+        index (SpatialIndex): Index over the station coordinates
+
+    Returns:
+        PollutionGrid: Grid with one array per metric, or None without stations
+    """
+    located = [point for point in index.points if point is not None]
+    if not located:
+        return None
+    lats = np.array([lat for lat, _ in located])
+    lngs = np.array([lng for _, lng in located])
+    # Per station position: coordinates and readings (NaN where missing)
+    station_lats = np.array([np.nan if p is None else p[0] for p in index.points])
+    station_lngs = np.array([np.nan if p is None else p[1] for p in index.points])
+    station_values = np.array(
+        [[np.nan if r.get(m) is None else r[m] for m in metrics] for r in readings], dtype=float
+    ).reshape(len(readings), len(metrics))
+    margin_lat = radius_km / KM_PER_DEGREE
+    margin_lng = radius_km / (KM_PER_DEGREE * math.cos(math.radians(min(89.0, np.abs(lats).max()))))
+    south = math.floor((lats.min() - margin_lat) / step) * step
+    west = math.floor((lngs.min() - margin_lng) / step) * step
+    rows = int(math.ceil((lats.max() + margin_lat - south) / step)) + 1
+    cols = int(math.ceil((lngs.max() + margin_lng - west) / step)) + 1
+    cell_lats = south + np.arange(rows) * step
+    cell_lngs = west + np.arange(cols) * step
+
+    grid = np.full((rows, cols, len(metrics)), np.nan, dtype=np.float32)
+    for r0 in range(0, rows, IDW_BLOCK):
+        block_lats = cell_lats[r0:r0 + IDW_BLOCK]
+        km_per_lng = KM_PER_DEGREE * math.cos(math.radians(min(89.0, np.abs(block_lats).max())))
+        for c0 in range(0, cols, IDW_BLOCK):
+            block_lngs = cell_lngs[c0:c0 + IDW_BLOCK]
+            center_lat = (block_lats[0] + block_lats[-1]) / 2
+            center_lng = (block_lngs[0] + block_lngs[-1]) / 2
+            # 1% slack for the flat-earth distances used inside idw()
+            half_diagonal = haversine_km(center_lat, center_lng, block_lats[0], block_lngs[0]) * 1.01
+            kth = index.nearest(center_lat, center_lng, IDW_NEIGHBOURS)
+            reach = radius_km
+            if len(kth) == IDW_NEIGHBOURS:
+                reach = min(radius_km, kth[-1][1] + half_diagonal)
+            reach = reach * 1.01 + half_diagonal
+            nearby = index.bbox(center_lat - reach / KM_PER_DEGREE, center_lng - reach / km_per_lng,
+                                center_lat + reach / KM_PER_DEGREE, center_lng + reach / km_per_lng)
+            if not nearby:
+                continue
+            grid[r0:r0 + IDW_BLOCK, c0:c0 + IDW_BLOCK] = idw(
+                block_lats, block_lngs, station_lats[nearby], station_lngs[nearby],
+                station_values[nearby], power, radius_km, IDW_NEIGHBOURS
+            )
+    return PollutionGrid(south, west, step, {
+        metric: np.ascontiguousarray(grid[..., k]) for k, metric in enumerate(metrics)
+    })
+
+# --- TILES ---
+
+def tile_bounds(z, x, y):
+    """(south, west, north, east) of a Web Mercator (slippy map) tile"""
+    n = 2 ** z
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return (lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180)
+
+def tile_pixel_coordinates(z, x, y, size=TILE_SIZE):
+    """Latitudes (per row) and longitudes (per column) of a tile's pixel centres"""
+    n = 2 ** z
+    offsets = (np.arange(size) + 0.5) / size
+    lngs = (x + offsets) / n * 360 - 180
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return lats, lngs
+
+def colorize(values, metric, alpha=TILE_ALPHA):
+    """RGBA uint8 image for an array of values; NaN becomes transparent"""
+    stops = COLOR_SCALES[metric]
+    levels = np.array([v for v, _ in stops], dtype=float)
+    colors = np.array([c for _, c in stops], dtype=float)
+    missing = np.isnan(values)
+    filled = np.where(missing, levels[0], values)
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(filled, levels, colors[:, channel]).astype(np.uint8)
+    rgba[..., 3] = np.where(missing, 0, alpha)
+    return rgba
+
+def encode_png(rgba):
+    """Encode an (h, w, 4) uint8 array as a PNG (no filtering, zlib compressed)"""
+    height, width, _ = rgba.shape
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    # Every scanline starts with its filter type (0: none)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)])
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) +
+            chunk(b"IEND", b""))
+
+_empty_tile = []
+
+def render_tile(grid, metric, z, x, y):
+    """PNG heatmap tile for z/x/y (fully transparent outside the grid)"""
+    south, west, north, east = tile_bounds(z, x, y)
+    grid_south, grid_west, grid_north, grid_east = grid.bounds
+    if south > grid_north or north < grid_south or west > grid_east or east < grid_west:
+        if not _empty_tile:
+            _empty_tile.append(encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)))
+        return _empty_tile[0]
+    lats, lngs = tile_pixel_coordinates(z, x, y)
+    values = grid.sample(metric, lats[:, None], lngs[None, :])
+    return encode_png(colorize(values, metric))
+
+# Binary grid layout: header, then rows x cols float32 (little endian, row 0
+# south, NaN for no value)
+GRID_HEADER = struct.Struct("<4sHHddd")  # b"EMSG", rows, cols, south, west, step
+
+def encode_grid(values, south, west, step):
+    """Compact binary form of a (cropped) grid"""
+    rows, cols = values.shape
+    return (GRID_HEADER.pack(b"EMSG", rows, cols, south, west, step) +
+            np.ascontiguousarray(values, dtype="<f4").tobytes())
+
+class GridEngine:
+    """
+    Keeps the interpolated grid of the current sensor tick.
+
+    The grid is rebuilt only when the version passed in (the sensor network
+    version) changes; concurrent callers for the same version wait for one
+    build instead of interpolating in parallel.
+    """
+
+    def __init__(self):
+        self._grid = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, version, readings, index):
+        """
+        Grid for a version, building it from readings/index on a miss
+
+        Returns:
+            PollutionGrid or None if there are no located stations
+        """
+        with self._lock:
+            if self._version != version:
+                self._grid = build_grid(readings, index)
+                self._version = version
+                self.builds += 1
+            return self._grid
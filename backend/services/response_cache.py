@@ -0,0 +1,155 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi import Response
+
+from services.compression import choose_encoding, compress, is_compressible, COMPRESSION_MIN_SIZE
+from services.serialization import dumps
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+
+def _opaque_tag(tag):
+    # '"<hash>-gzip"', 'W/"<hash>"' -> '<hash>'
+    return tag.strip().removeprefix("W/").strip('"').split("-")[0]
+
+def etag_matches(if_none_match, etag):
+    """
+    True if an If-None-Match header names the ETag
+
+    Comparison is weak and ignores the content-coding suffix, so a client
+    holding any encoding of the same body gets a 304.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return _opaque_tag(etag) in (_opaque_tag(tag) for tag in if_none_match.split(","))
+
+class CachedBody:
+    """Serialized body plus its compressed variants, created on first request"""
+
+    __slots__ = ('version', 'body', 'media_type', 'hash', 'encoded')
+
+    def __init__(self, version, body, media_type="application/json"):
+        self.version = version
+        self.body = body
+        self.media_type = media_type
+        self.hash = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.encoded = {}
+
+    @property
+    def etag(self):
+        return f'"{self.hash}"'
+
+    def representation(self, encoding):
+        """
+        Body and ETag for a content coding
+
+        Args:
+            encoding (str): "br", "gzip" or None
+
+        Returns:
+            tuple: (body, encoding actually used, etag)
+        """
+        if (encoding is None or len(self.body) < COMPRESSION_MIN_SIZE or
+                not is_compressible(self.media_type)):
+            return self.body, None, self.etag
+        body = self.encoded.get(encoding)
+        if body is None:
+            body = self.encoded[encoding] = compress(self.body, encoding)
+        # Each coding is a different representation, so it gets its own ETag
+        return body, encoding, f'"{self.hash}-{encoding}"'
+
+class ResponseCache:
+    """
+    Serialized responses (JSON, or raw bytes such as map tiles) keyed by
+    resource, valid for one data version.
+
+    Callers pass the current version of whatever the response is built from
+    (a counter, a timestamp...). While it is unchanged, the cached bytes are
+    sent as they are, and clients presenting the matching ETag get a 304
+    without anything being built or serialized. The ETag is a hash of the
+    bytes, so a rebuild that produces the same payload keeps the same ETag.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get_or_build(self, key, version, build, media_type="application/json"):
+        """
+        Cached body for key at version, building it on a miss
+
+        Args:
+            key (tuple): Resource and every parameter the response depends on
+            version: Current version of the underlying data
+            build (callable): Returns the payload to serialize, or the body
+                itself as bytes (e.g. an image)
+            media_type (str): Content type of the body
+
+        Returns:
+            CachedBody: Serialized body and its ETag
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Build outside the lock; two concurrent misses just build twice
+        payload = build()
+        body = payload if isinstance(payload, bytes) else dumps(payload)
+        entry = CachedBody(version, body, media_type)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def respond(self, request, key, version, build, media_type="application/json"):
+        """
+        Response for a read endpoint: 304 if the client's copy is current
+
+        The body is sent pre-compressed when the client accepts it, from
+        variants compressed once per cached entry.
+
+        Args:
+            request (Request): Incoming request (for If-None-Match, Accept-Encoding)
+            key, version, build, media_type: As for get_or_build
+
+        Returns:
+            Response: 304 Not Modified or 200 with the cached JSON bytes
+        """
+        entry = self.get_or_build(key, version, build, media_type)
+        body, encoding, etag = entry.representation(
+            choose_encoding(request.headers.get("accept-encoding"))
+        )
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=entry.media_type, headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified
+        }
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import time
+
+from services.api_client import fetch_environmental_data_async, fetch_environmental_data_many
+from services.sensor_registry import sensor_registry
+from risk_engine import calculate_risk
+from database import log_readings
+
+# Seconds between two sampling rounds (matches the dashboard refresh rate)
+SAMPLE_INTERVAL = float(os.getenv("SAMPLE_INTERVAL", "5"))
+# Seconds the sampling leader's lease stays valid without renewal; another
+# worker takes over this long after the leader stops
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", str(3 * SAMPLE_INTERVAL)))
+
+# /api/monitor's default city, which has no sensors of its own
+DEFAULT_CITY = "Kozhikode"
+
+def load_monitored_cities():
+    """
+    Cities sampled by the scheduler.
+    
+    Uses the comma-separated MONITOR_CITIES env var when set, otherwise every
+    location in mock_sensors.json plus the default monitor city.
+    """
+    configured = os.getenv("MONITOR_CITIES")
+    if configured:
+        return [c.strip() for c in configured.split(",") if c.strip()]
+    
+    return list(dict.fromkeys([*sensor_registry.cities(), DEFAULT_CITY]))
+
+def is_known_city(city):
+    """Whether a city may be monitored: a sensor location, a MONITOR_CITIES entry or the default city"""
+    return city in load_monitored_cities() or city in sensor_registry.cities() or city == DEFAULT_CITY
+
+class SamplingScheduler:
+    """
+    Samples every monitored city at a fixed cadence, independent of traffic.
+    
+    Each round fetches and scores one reading per city, writes the whole round
+    as one batch and replaces the per-city snapshot that /api/monitor serves.
+    
+    With several worker processes, only the holder of the leader lease
+    samples and writes history; it publishes each round to the shared store
+    and the other workers pick it up from there, so every reading is logged
+    once and every worker serves the same snapshots. Cities added on any
+    worker join the leader's rotation through the store as well.
+    """
+
+    def __init__(self, cities, interval=SAMPLE_INTERVAL, store=None, lease=None):
+        """
+        Args:
+            cities (list): Cities sampled every round
+            interval (float): Seconds between two rounds
+            store: State store shared with the other workers (None: this process only)
+            lease (LeaderLease): Lease deciding which worker samples (None: always this one)
+        """
+        self.cities = list(dict.fromkeys(cities))
+        self.interval = interval
+        self.store = store
+        self.lease = lease
+        self._snapshots = {}
+        self._round_seen = None
+        # Async callables run with the snapshots of every completed round
+        self.listeners = []
+
+    @property
+    def is_leader(self):
+        """Whether this process samples and writes history"""
+        return self.lease is None or self.lease.held
+
+    def latest(self, city):
+        """Most recent snapshot for a city, or None if it was never sampled"""
+        return self._snapshots.get(city)
+
+    def _publish(self, city, data):
+        score, alerts = calculate_risk(data)
+        snapshot = {"data": data, "score": score, "alerts": alerts}
+        self._snapshots[city] = snapshot
+        return snapshot
+
+    async def sample_city(self, city):
+        """Fetch and score one reading for a city and publish it as its snapshot"""
+        return self._publish(city, await fetch_environmental_data_async(city))
+
+    async def add_city(self, city):
+        """
+        Start monitoring a known city that is not sampled yet
+
+        Only cities from the sensor registry or MONITOR_CITIES can join the
+        rotation, so arbitrary query strings cannot grow it.
+
+        Returns:
+            dict: The city's first snapshot, or None if the city is unknown
+        """
+        if city not in self.cities:
+            if not is_known_city(city):
+                return None
+            self.cities.append(city)
+            if self.store is not None:
+                await asyncio.to_thread(self.store.update, 'scheduler', 'cities', lambda cities: list(
+                    dict.fromkeys([*(cities or []), city])
+                ))
+            print(f"📍 Now monitoring {city}")
+        return self.latest(city) or await self.sample_city(city)
+
+    async def _notify(self, snapshots):
+        for listener in self.listeners:
+            try:
+                await listener(snapshots)
+            except Exception as e:
+                print(f"❌ Round listener failed: {e}")
+
+    async def sample_all(self):
+        """Run one sampling round over every city (fetched concurrently) and log it as a single batch"""
+        if self.store is not None:
+            added = await asyncio.to_thread(self.store.get, 'scheduler', 'cities')
+            self.cities = list(dict.fromkeys([*self.cities, *(added or [])]))
+        readings = await fetch_environmental_data_many(self.cities)
+        snapshots = []
+        for city, data in readings.items():
+            try:
+                snapshots.append(self._publish(city, data))
+            except Exception as e:
+                print(f"❌ Error sampling {city}: {e}")
+        log_readings([(s["data"], s["score"]) for s in snapshots])
+        if self.store is not None:
+            self._round_seen = time.time()
+            await asyncio.to_thread(self.store.put, 'scheduler', 'round', {
+                'sampled_at': self._round_seen, 'snapshots': snapshots
+            })
+        await self._notify(snapshots)
+        return snapshots
+
+    async def follow(self):
+        """Take over the leader's latest round, if it is new; nothing is logged"""
+        latest = await asyncio.to_thread(self.store.get, 'scheduler', 'round')
+        if latest is None or latest['sampled_at'] == self._round_seen:
+            return []
+        self._round_seen = latest['sampled_at']
+        snapshots = latest['snapshots']
+        for snapshot in snapshots:
+            self._snapshots[snapshot["data"]["location"]] = snapshot
+        await self._notify(snapshots)
+        return snapshots
+
+    async def tick(self):
+        """One round: sample as the leader, otherwise follow the leader's round"""
+        if self.lease is not None and not await asyncio.to_thread(self.lease.acquire):
+            return await self.follow()
+        return await self.sample_all()
+
+    async def run(self):
+        """Sampling loop, meant to run as a background task"""
+        next_tick = time.monotonic()
+        while True:
+            # Skip missed ticks instead of bursting after a slow round
+            next_tick = max(next_tick + self.interval, time.monotonic())
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"❌ Sampling round failed: {e}")
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from services.spatial_index import SpatialIndex
+
+SENSORS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data", "mock_sensors.json")
+# Seconds between two checks of the file's modification time
+SENSOR_RELOAD_INTERVAL = float(os.getenv("SENSOR_RELOAD_INTERVAL", "2"))
+
+class SensorRegistry:
+    """
+    Station metadata from mock_sensors.json, parsed once and kept in memory.
+
+    Stations are read-only mappings in a tuple, so they can be shared between
+    requests and threads; live readings are built as new dicts from them
+    (see api_client.enrich_sensor_network_async). The file's mtime is checked at
+    most every reload_interval seconds and the registry reloads when it
+    changes. A file that fails to parse keeps the previous stations.
+
+    Each load also builds a spatial index over the station coordinates; its
+    query results are positions in the station tuple of the same snapshot.
+
+    The version is a hash of the file contents rather than a load counter, so
+    every worker process gives the same file the same version (it is stored
+    next to the shared sensor network, see api_client._cached_sensors).
+    """
+
+    def __init__(self, path=SENSORS_PATH, reload_interval=SENSOR_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        # (stations, index, version), replaced as a whole on reload; version is None until loaded
+        self._snapshot = (None, None, None)
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """(Re)load the file if it changed since the last load"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            mtime = self._file_mtime()
+            if self._snapshot[2] is not None and mtime == self._mtime:
+                return
+            if mtime is None:
+                print(f"⚠️  mock_sensors.json not found at {self.path}")
+                self._snapshot = (None, None, "missing")
+            else:
+                try:
+                    with open(self.path, "rb") as f:
+                        raw = f.read()
+                    stations = json.loads(raw)
+                except (OSError, ValueError) as e:
+                    print(f"⚠️  Could not load {self.path}, keeping previous sensors: {e}")
+                    return
+                version = hashlib.sha256(raw).hexdigest()[:16]
+                if version == self._snapshot[2]:
+                    # Touched but not changed
+                    self._mtime = mtime
+                    return
+                stations = tuple(MappingProxyType(dict(s)) for s in stations)
+                index = SpatialIndex([station_point(s) for s in stations])
+                self._snapshot = (stations, index, version)
+                print(f"✅ Loaded {len(stations)} sensor(s)")
+            self._mtime = mtime
+
+    def snapshot(self):
+        """
+        Current stations with their index, reloading first if the file changed
+
+        Returns:
+            tuple: (stations, index, version). stations is a tuple of
+                read-only mappings (None if the file is missing), index a
+                SpatialIndex over them and version a hash of the file
+                contents ("missing" if there is no file), the same in every
+                process.
+        """
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.reload_interval:
+            self.load()
+        return self._snapshot
+
+    def stations(self):
+        """Current stations, or None if the file is missing"""
+        return self.snapshot()[0]
+
+    @property
+    def version(self):
+        return self._snapshot[2]
+
+    def nearest(self, lat, lng, k=1, max_km=None):
+        """
+        Stations closest to a location
+
+        Returns:
+            list: (station, distance_km) pairs, closest first
+        """
+        stations, index, _ = self.snapshot()
+        if stations is None:
+            return []
+        return [(stations[p], km) for p, km in index.nearest(lat, lng, k, max_km)]
+
+    def cities(self):
+        """Distinct station locations, in file order"""
+        return list(dict.fromkeys(s.get("location") for s in self.stations() or () if s.get("location")))
+
+def station_point(station):
+    """(lat, lng) of a station, or None if it has no coordinates"""
+    lat, lng = station.get("lat"), station.get("lng", station.get("lon"))
+    if lat is None or lng is None:
+        return None
+    return (float(lat), float(lng))
+
+sensor_registry = SensorRegistry()
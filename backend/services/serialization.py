@@ -0,0 +1,38 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+# orjson is optional: several times faster than the json module on the large
+# lists /api/history and /api/sensors return, but everything works without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(payload):
+    """
+    Serialize a payload to JSON bytes
+    
+    Args:
+        payload: JSON-compatible data (dicts, lists, str, numbers, None)
+    
+    Returns:
+        bytes: Compact UTF-8 JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(
+        payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with orjson when it is installed.
+    
+    Used as the app's default response class. Endpoints returning large
+    payloads return it directly, which also skips FastAPI's
+    jsonable_encoder pass over already JSON-ready data.
+    """
+
+    def render(self, content):
+        return dumps(content)
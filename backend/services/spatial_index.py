@@ -0,0 +1,129 @@
+import heapq
+import math
+import os
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Grid cell size in degrees; unset sizes cells for about two points each
+SPATIAL_CELL_DEG = float(os.getenv("SPATIAL_CELL_DEG", "0")) or None
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class SpatialIndex:
+    """
+    Uniform lat/lng grid over a fixed set of points.
+
+    Points are bucketed by cell, so a bounding-box query only looks at the
+    cells it overlaps and a nearest-neighbour query searches rings of cells
+    outwards from the query point until nothing closer can be left. Both
+    return positions in the original point list, so callers can look up
+    whatever they keep alongside it.
+    """
+
+    def __init__(self, points, cell_deg=SPATIAL_CELL_DEG):
+        """
+        Args:
+            points (list): (lat, lng) pairs; None entries are skipped
+            cell_deg (float): Grid cell size in degrees (None: from the data)
+        """
+        self.points = list(points)
+        self.cell_deg = cell_deg or self._auto_cell_deg()
+        self.cells = {}
+        for i, point in enumerate(self.points):
+            if point is not None:
+                self.cells.setdefault(self._cell(*point), []).append(i)
+        rows = [i for i, _ in self.cells] or [0]
+        cols = [j for _, j in self.cells] or [0]
+        self.extent = (min(rows), min(cols), max(rows), max(cols))
+
+    def _auto_cell_deg(self):
+        located = [p for p in self.points if p is not None]
+        if len(located) < 2:
+            return 1.0
+        lats = [lat for lat, _ in located]
+        lngs = [lng for _, lng in located]
+        area = max(max(lats) - min(lats), 0.01) * max(max(lngs) - min(lngs), 0.01)
+        return max(0.001, math.sqrt(2 * area / len(located)))
+
+    def __len__(self):
+        return sum(len(members) for members in self.cells.values())
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _ring(self, ci, cj, ring):
+        """Cells exactly `ring` steps (Chebyshev distance) from (ci, cj), within the extent"""
+        imin, jmin, imax, jmax = self.extent
+        if ring == 0:
+            yield ci, cj
+            return
+        for i in (ci - ring, ci + ring):
+            if imin <= i <= imax:
+                for j in range(max(cj - ring, jmin), min(cj + ring, jmax) + 1):
+                    yield i, j
+        for j in (cj - ring, cj + ring):
+            if jmin <= j <= jmax:
+                for i in range(max(ci - ring + 1, imin), min(ci + ring - 1, imax) + 1):
+                    yield i, j
+
+    def bbox(self, south, west, north, east):
+        """
+        Points inside a bounding box (edges included)
+
+        Returns:
+            list: Positions of the points, in ascending order
+        """
+        (i0, j0), (i1, j1) = self._cell(south, west), self._cell(north, east)
+        # Only cells inside the occupied extent can hold points
+        imin, jmin, imax, jmax = self.extent
+        i0, j0, i1, j1 = max(i0, imin), max(j0, jmin), min(i1, imax), min(j1, jmax)
+        found = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for p in self.cells.get((i, j), ()):
+                    lat, lng = self.points[p]
+                    if south <= lat <= north and west <= lng <= east:
+                        found.append(p)
+        found.sort()
+        return found
+
+    def nearest(self, lat, lng, k=1, max_km=None):
+        """
+        The k points closest to a location
+
+        Args:
+            lat, lng (float): Query location
+            k (int): Number of points wanted
+            max_km (float): Ignore points further away than this
+
+        Returns:
+            list: (position, distance_km) pairs, closest first
+        """
+        if k <= 0 or not self.cells:
+            return []
+        ci, cj = self._cell(lat, lng)
+        # Rings that overlap the occupied cells at all
+        imin, jmin, imax, jmax = self.extent
+        first_ring = max(imin - ci, ci - imax, jmin - cj, cj - jmax, 0)
+        last_ring = max(ci - imin, imax - ci, cj - jmin, jmax - cj, 0)
+        found = []
+        for ring in range(first_ring, last_ring + 1):
+            for cell in self._ring(ci, cj, ring):
+                for p in self.cells.get(cell, ()):
+                    found.append((p, haversine_km(lat, lng, *self.points[p])))
+            # Anything beyond this ring is more than `ring` cells away in
+            # latitude or longitude; longitude degrees shrink towards the poles
+            widest_lat = min(89.9, abs(lat) + (ring + 1) * self.cell_deg)
+            reach_km = ring * self.cell_deg * KM_PER_DEGREE * math.cos(math.radians(widest_lat))
+            if max_km is not None and reach_km > max_km:
+                break
+            if len(found) >= k and heapq.nsmallest(k, (d for _, d in found))[-1] <= reach_km:
+                break
+        if max_km is not None:
+            found = [item for item in found if item[1] <= max_km]
+        return heapq.nsmallest(k, found, key=lambda item: item[1])
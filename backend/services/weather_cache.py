@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "300"))
+WEATHER_CACHE_STALE_TTL = float(os.getenv("WEATHER_CACHE_STALE_TTL", "600"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "256"))
+
+class WeatherCache:
+    """
+    Per-city cache of upstream weather observations.
+    
+    Entries younger than ttl are served as-is. Entries up to ttl + stale_ttl
+    old are still served, but trigger a single background refresh
+    (stale-while-revalidate). Older entries, and cities never seen before, are
+    fetched inline. The least recently used city is evicted once max_entries
+    is exceeded. Failed fetches (None) are never cached.
+    """
+
+    def __init__(self, ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_CACHE_STALE_TTL, max_entries=WEATHER_CACHE_SIZE):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._inflight = {}
+        self._tasks = set()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'evictions': 0}
+
+    def _lookup(self, city):
+        """Return ('fresh' | 'stale' | 'miss', weather) and update the counters"""
+        with self._lock:
+            entry = self._entries.get(city)
+            if entry is not None:
+                weather, fetched_at = entry
+                age = time.monotonic() - fetched_at
+                if age < self.ttl:
+                    self._entries.move_to_end(city)
+                    self._stats['hits'] += 1
+                    return 'fresh', weather
+                if age < self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(city)
+                    self._stats['stale_hits'] += 1
+                    return 'stale', weather
+            self._stats['misses'] += 1
+            return 'miss', None
+
+    def _claim_refresh(self, city):
+        with self._lock:
+            if city in self._refreshing:
+                return False
+            self._refreshing.add(city)
+            self._stats['refreshes'] += 1
+            return True
+
+    def _release_refresh(self, city):
+        with self._lock:
+            self._refreshing.discard(city)
+
+    def put(self, city, weather):
+        """Store a fresh observation (None is ignored)"""
+        if weather is None:
+            return
+        with self._lock:
+            self._entries[city] = (weather, time.monotonic())
+            self._entries.move_to_end(city)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    async def aget_or_fetch(self, city, fetch):
+        """Async lookup; concurrent misses for the same city share one upstream call"""
+        status, weather = self._lookup(city)
+        if status == 'fresh':
+            return weather
+        if status == 'stale':
+            if self._claim_refresh(city):
+                task = asyncio.create_task(self._refresh_async(city, fetch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return weather
+        return await self._fetch_once(city, fetch)
+
+    async def _fetch_once(self, city, fetch):
+        inflight = self._inflight.get(city)
+        if inflight is None:
+            inflight = asyncio.ensure_future(fetch(city))
+            self._inflight[city] = inflight
+            try:
+                weather = await inflight
+            finally:
+                self._inflight.pop(city, None)
+            self.put(city, weather)
+            return weather
+        return await asyncio.shield(inflight)
+
+    async def _refresh_async(self, city, fetch):
+        try:
+            await self._fetch_once(city, fetch)
+        finally:
+            self._release_refresh(city)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters plus the current number of cached cities"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['stale_hits'] + self._stats['misses']
+            served = self._stats['hits'] + self._stats['stale_hits']
+            return {
+                **self._stats,
+                'entries': len(self._entries),
+                'hit_ratio': round(served / lookups, 3) if lookups else 0.0,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl
+            }
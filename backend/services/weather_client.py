@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+import httpx
+
+# Base URL is configurable so the client can be pointed at a local stub server
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "http://api.weatherapi.com/v1/current.json")
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "3"))
+WEATHER_MAX_CONNECTIONS = int(os.getenv("WEATHER_MAX_CONNECTIONS", "10"))
+WEATHER_MAX_CONCURRENCY = int(os.getenv("WEATHER_MAX_CONCURRENCY", "8"))
+
+class WeatherAPIError(Exception):
+    """Non-200 response from the weather upstream"""
+
+    def __init__(self, status_code):
+        super().__init__(f"WeatherAPI returned HTTP {status_code}")
+        self.status_code = status_code
+
+def parse_weather(wx):
+    """Pick the fields we use out of a WeatherAPI current.json response"""
+    current = wx['current']
+    return {
+        'wind_dir': current['wind_dir'],
+        'temp_c': current['temp_c'],
+        'humidity': current['humidity']
+    }
+
+class AsyncWeatherClient:
+    """
+    Asyncio WeatherAPI client with a shared keep-alive connection pool.
+    
+    At most max_concurrency requests are in flight at once, so fetching every
+    city in parallel cannot flood the upstream.
+    """
+
+    def __init__(self, api_key=None, base_url=WEATHER_API_URL, timeout=WEATHER_TIMEOUT,
+                 max_connections=WEATHER_MAX_CONNECTIONS, max_concurrency=WEATHER_MAX_CONCURRENCY):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    def _ensure_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def close(self):
+        """Close the connection pool (called on shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, city):
+        """
+        Fetch current weather for one city.
+        
+        Returns:
+            dict: wind_dir, temp_c and humidity, or None if no API key is set
+        
+        Raises:
+            WeatherAPIError: On a non-200 response
+            httpx.HTTPError: On connection errors and timeouts
+        """
+        if not self.api_key:
+            return None
+        client = self._ensure_client()
+        async with self._semaphore:
+            response = await client.get(
+                self.base_url,
+                params={'key': self.api_key, 'q': city, 'aqi': 'yes'}
+            )
+        if response.status_code != 200:
+            raise WeatherAPIError(response.status_code)
+        return parse_weather(response.json())
@@ -0,0 +1,30 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import main
+from services.scheduler import DEFAULT_CITY
+
+def report(location):
+    return main.CitizenReportModel(location=location, report_type="smoke", severity=4)
+
+class ReportValidationTest(unittest.TestCase):
+    def check(self, location, reading):
+        fetch = mock.AsyncMock(return_value=reading)
+        with mock.patch.object(main, "fetch_environmental_data_async", fetch):
+            result = asyncio.run(main.check_report_against_sensors(report(location)))
+        return result, fetch
+
+    def test_unknown_location_is_not_fetched(self):
+        result, fetch = self.check("Somewhere Else 123", {"pm25": 80})
+        fetch.assert_not_called()
+        self.assertFalse(result["validated"])
+        self.assertEqual(result["confidence"], "pending")
+
+    def test_known_city_is_checked_against_its_readings(self):
+        result, fetch = self.check(DEFAULT_CITY, {"pm25": 80})
+        fetch.assert_awaited_once_with(DEFAULT_CITY)
+        self.assertTrue(result["validated"])
+
+if __name__ == "__main__":
+    unittest.main()
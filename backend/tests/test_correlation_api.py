@@ -0,0 +1,24 @@
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+import main
+from services.correlations import LAGGED_MAX_POINTS
+
+class CorrelationMatrixLimitTest(unittest.TestCase):
+    def test_limit_above_cap_is_rejected(self):
+        with mock.patch.object(main, "get_history") as get_history:
+            with self.assertRaises(HTTPException) as raised:
+                main.get_correlation_matrix(limit=LAGGED_MAX_POINTS + 1)
+        self.assertEqual(raised.exception.status_code, 400)
+        get_history.assert_not_called()
+
+    def test_limit_at_cap_is_accepted(self):
+        with mock.patch.object(main, "get_history", return_value=[]) as get_history:
+            result = main.get_correlation_matrix(limit=LAGGED_MAX_POINTS)
+        self.assertEqual(result["status"], "success")
+        get_history.assert_called_once_with(LAGGED_MAX_POINTS, location=None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+import numpy as np
+
+from services.interpolation import PollutionGrid, encode_grid, GRID_HEADER
+
+def make_grid(rows=11, cols=21):
+    values = np.arange(rows * cols, dtype=np.float32).reshape(rows, cols)
+    return PollutionGrid(10.0, 75.0, 0.1, {"pm25": values})
+
+class CropTest(unittest.TestCase):
+    def test_crop_inside(self):
+        values, south, west, step = make_grid().crop("pm25", 10.2, 75.3, 10.4, 75.5)
+        self.assertEqual(values.shape, (3, 3))
+        self.assertAlmostEqual(south, 10.2)
+        self.assertAlmostEqual(west, 75.3)
+        self.assertEqual(values[0, 0], 2 * 21 + 3)
+
+    def test_crop_outside_grid_is_empty(self):
+        grid = make_grid()
+        for bbox in [(9, 74, 9.5, 74.5), (12, 77, 13, 78), (10.2, 74, 10.4, 74.5), (9, 75.3, 9.5, 75.5)]:
+            values, _, _, _ = grid.crop("pm25", *bbox)
+            self.assertEqual(values.size, 0, bbox)
+
+    def test_empty_crop_encodes(self):
+        body = encode_grid(*make_grid().crop("pm25", 9, 74, 9.5, 74.5))
+        self.assertEqual(len(body), GRID_HEADER.size)
+        self.assertEqual(GRID_HEADER.unpack(body)[1:3], (0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
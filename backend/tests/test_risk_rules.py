@@ -0,0 +1,76 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+
+import risk_engine
+from risk_engine import RiskRules, RuleError, RULES_PATH
+
+with open(RULES_PATH, encoding="utf-8") as f:
+    TABLE = json.load(f)
+
+def table_with(**changes):
+    """The shipped table with the first pm25 rule changed"""
+    table = copy.deepcopy(TABLE)
+    rule = next(r for r in table['rules'] if r.get('metric') == 'pm25')
+    rule.update(changes)
+    return table
+
+def with_message(message):
+    table = copy.deepcopy(TABLE)
+    rule = next(r for r in table['rules'] if r.get('metric') == 'pm25')
+    rule['tiers'][0]['message'] = message
+    return table
+
+MALFORMED = {
+    "empty tiers": table_with(tiers=[]),
+    "unsorted tiers": table_with(tiers=[
+        {"op": ">", "value": 25, "points": 10},
+        {"op": ">", "value": 55, "points": 40},
+    ]),
+    "bad conversion": with_message("PM2.5 {pm25!x}"),
+    "unbalanced brace": with_message("PM2.5 {pm25"),
+    "bad format spec": with_message("PM2.5 {pm25:.1q}"),
+    "unknown field": with_message("PM2.5 {nope}"),
+}
+
+class RuleTableTest(unittest.TestCase):
+    def test_shipped_table_compiles(self):
+        score, alerts = RiskRules(TABLE).evaluate({'pm25': 60.0})
+        self.assertGreater(score, 0)
+        self.assertTrue(alerts)
+
+    def test_malformed_tables_raise_rule_error(self):
+        for name, table in MALFORMED.items():
+            with self.subTest(name):
+                with self.assertRaises(RuleError):
+                    RiskRules(table)
+
+class ReloadTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "rules.json")
+        self.saved = (risk_engine.RULES_PATH, risk_engine._rules, risk_engine._rules_mtime)
+        risk_engine.RULES_PATH = self.path
+
+    def tearDown(self):
+        risk_engine.RULES_PATH, risk_engine._rules, risk_engine._rules_mtime = self.saved
+
+    def write(self, table, mtime):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(table, f)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_bad_table_keeps_previous_rules(self):
+        self.write(TABLE, 1000)
+        good = risk_engine.reload_rules(force=True)
+        expected = risk_engine.calculate_risk({'pm25': 60.0})
+        for i, (name, table) in enumerate(MALFORMED.items()):
+            with self.subTest(name):
+                self.write(table, 2000 + i)
+                self.assertIs(risk_engine.reload_rules(), good)
+                self.assertEqual(risk_engine.get_rules().evaluate({'pm25': 60.0}), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+
+from services.sensor_registry import SensorRegistry
+
+STATIONS = [{"id": "S1", "location": "Kochi", "lat": 9.93, "lng": 76.26}]
+
+class RegistryVersionTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.write(STATIONS, mtime=1_000_000)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, stations, mtime):
+        with open(self.path, "w") as f:
+            json.dump(stations, f)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_same_file_same_version_in_every_registry(self):
+        first = SensorRegistry(self.path, 0)
+        first.snapshot()
+        self.write(STATIONS + [{"id": "S2", "location": "Kannur", "lat": 11.87, "lng": 75.37}], mtime=1_000_010)
+        first.snapshot()
+        # A process started after the change has loaded the file only once
+        second = SensorRegistry(self.path, 0)
+        second.snapshot()
+        self.assertIsNotNone(first.version)
+        self.assertEqual(first.version, second.version)
+
+    def test_version_follows_contents(self):
+        registry = SensorRegistry(self.path, 0)
+        registry.snapshot()
+        loaded = registry.version
+        self.write(STATIONS, mtime=1_000_010)
+        registry.snapshot()
+        self.assertEqual(registry.version, loaded)
+        self.write(STATIONS + [{"id": "S2", "location": "Kannur", "lat": 11.87, "lng": 75.37}], mtime=1_000_020)
+        self.assertEqual(len(registry.snapshot()[0]), 2)
+        self.assertNotEqual(registry.version, loaded)
+
+    def test_missing_file(self):
+        os.remove(self.path)
+        registry = SensorRegistry(self.path, 0)
+        stations, _, version = registry.snapshot()
+        self.assertIsNone(stations)
+        self.assertEqual(version, "missing")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,17 +4,50 @@
 -- Existing history table
 CREATE TABLE IF NOT EXISTS history (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp TEXT NOT NULL,
+    ts INTEGER NOT NULL,  -- Epoch milliseconds, UTC
     pm25 REAL,
     wind_kph REAL,
     wind_dir TEXT,
     noise REAL,
     risk_score INTEGER,
-    alert_triggered BOOLEAN
+    alert_triggered BOOLEAN,
+    location TEXT,   -- City the reading belongs to
+    sensor_id TEXT,  -- NULL for city-level readings
+    temp_c REAL,
+    humidity REAL
 );
 
--- Index for faster time-series querying
-CREATE INDEX IF NOT EXISTS idx_timestamp ON history(timestamp);
+-- Time-range queries; the metric columns make range scans covering
+CREATE INDEX IF NOT EXISTS idx_history_ts ON history(ts, pm25, wind_kph, noise, risk_score);
+-- Per-city and per-sensor time-range queries
+CREATE INDEX IF NOT EXISTS idx_history_location_ts ON history(location, ts, pm25, wind_kph, noise, risk_score);
+CREATE INDEX IF NOT EXISTS idx_history_location_sensor_ts ON history(location, sensor_id, ts);
+
+-- Time-bucketed rollups of history, maintained as readings are written
+-- resolution: '1m', '1h' or '1d'; location: city ('' for readings without one);
+-- bucket: start of the bucket in epoch milliseconds (UTC)
+CREATE TABLE IF NOT EXISTS history_rollup (
+    resolution TEXT NOT NULL,
+    location TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    pm25_min REAL, pm25_max REAL, pm25_sum REAL, pm25_count INTEGER,
+    wind_kph_min REAL, wind_kph_max REAL, wind_kph_sum REAL, wind_kph_count INTEGER,
+    noise_min REAL, noise_max REAL, noise_sum REAL, noise_count INTEGER,
+    risk_score_min REAL, risk_score_max REAL, risk_score_sum REAL, risk_score_count INTEGER,
+    PRIMARY KEY (resolution, location, bucket)
+) WITHOUT ROWID;
+
+-- All-city trend queries
+CREATE INDEX IF NOT EXISTS idx_rollup_resolution_bucket ON history_rollup(resolution, bucket);
+
+-- Change counter per table, bumped in the transaction of every write; shared
+-- by every worker process, so each can tell when its cached responses are stale
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO data_versions (name, version) VALUES ('history', 0), ('citizen_reports', 0);
 
 -- NEW: Citizen Reports Table
 CREATE TABLE IF NOT EXISTS citizen_reports (
@@ -90,7 +90,7 @@ function App() {
   // Fetch historical data
   const fetchHistory = async () => {
     try {
-      const response = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/history?limit=24`);
+      const response = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/history?limit=24&city=${selectedCity}`);
       if (!response.ok) throw new Error('History fetch failed');
       const data = await response.json();
       
@@ -144,7 +144,7 @@ function App() {
   // Fetch correlations
   const fetchCorrelations = async () => {
     try {
-      const response = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/correlations`);
+      const response = await fetch(`${process.env.REACT_APP_API_BASE_URL}/api/correlations?city=${selectedCity}`);
       if (!response.ok) {
         console.warn('Correlations fetch failed (non-critical)');
         return;
@@ -241,20 +241,39 @@ function App() {
 
     loadData();
 
-    const fastInterval = setInterval(() => {
-      console.log('⏰ 5-second refresh triggered');
-      fetchMonitorData();
-      fetchHistory();
-      fetchCorrelations();
-    }, 5000);
+    // Live updates are pushed by the backend after every sampling round
+    const stream = new EventSource(`${process.env.REACT_APP_API_BASE_URL}/api/stream?city=${selectedCity}`);
 
-    const slowInterval = setInterval(() => {
-      fetchSensors();
-    }, 10000); 
+    stream.addEventListener('monitor', (e) => {
+      setMonitorData(JSON.parse(e.data));
+      setError(null);
+    });
+
+    stream.addEventListener('reading', (e) => {
+      const reading = JSON.parse(e.data);
+      setHistoryData(prev => {
+        const newData = [reading, ...prev].slice(0, 24);
+        prevHistoryRef.current = newData;
+        return newData;
+      });
+      setChartKey(prev => prev + 1); // Force chart refresh
+    });
+
+    stream.addEventListener('correlations', (e) => {
+      setCorrelations(JSON.parse(e.data).correlations);
+    });
+
+    stream.addEventListener('sensors', (e) => {
+      setSensors(JSON.parse(e.data).sensors || []);
+    });
+
+    stream.onerror = () => {
+      // EventSource reconnects on its own
+      console.warn('Live stream interrupted, reconnecting...');
+    };
 
     return () => {
-      clearInterval(fastInterval);
-      clearInterval(slowInterval);
+      stream.close();
     };
   }, [selectedCity]); 
 
@@ -640,6 +659,11 @@ function App() {
               url="https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png"
               attribution='&copy; OpenStreetMap &copy; CARTO'
             />
+            {/* Interpolated PM2.5 heatmap, rendered server-side */}
+            <TileLayer
+              url={`${process.env.REACT_APP_API_BASE_URL}/api/grid/pm25/{z}/{x}/{y}.png`}
+              opacity={0.6}
+            />
             {citySensors.map(sensor => (
               <Marker key={sensor.id} position={[sensor.lat, sensor.lon || sensor.lng]}>
                 <Popup className="sensor-popup">